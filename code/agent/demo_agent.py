@@ -1,26 +1,31 @@
 import time
 import atexit
 import getpass
-import requests  # install the package via "pip install requests"
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+
+from agent.speakeasy_client import SpeakeasyClient
 
 # url of the speakeasy server
 url = 'https://server5.speakeasy-ai.org'
 listen_freq = 3
+max_messages_in_chat_state = 50  # Only the last messages of each room are kept
 
 
 class DemoBot:
     def __init__(self, username, password):
         self.chat_state = None
+        self.client = None
         self.session_token = None
         self.agent_details = None
         self.username = username
         self.password = password
 
     def connect(self):
+        self.client = SpeakeasyClient(url, self.username, self.password)
         self.agent_details = self.login(self.username, self.password)
         self.session_token = self.agent_details['sessionToken']
-        self.chat_state = defaultdict(lambda: {'messages': defaultdict(dict), 'initiated': False, 'my_alias': None})
+        self.chat_state = defaultdict(
+            lambda: {'messages': OrderedDict(), 'initiated': False, 'my_alias': None, 'last_ordinal': -1})
 
         atexit.register(self.logout)
 
@@ -38,38 +43,56 @@ class DemoBot:
                         self.chat_state[room_id]['initiated'] = True
                         self.chat_state[room_id]['my_alias'] = room['alias']
 
-                    # check for all messages
-                    all_messages = self.check_room_state(room_id=room_id, since=0, session_token=self.session_token)['messages']
+                    # check for the new messages
+                    new_messages = self.get_new_messages(room_id=room_id)
 
                     # you can also use ["reactions"] to get the reactions of the messages: STAR, THUMBS_UP, THUMBS_DOWN
 
-                    for message in all_messages:
+                    for message in new_messages:
                         if message['authorAlias'] != self.chat_state[room_id]['my_alias']:
+                            self.remember_message(room_id=room_id, message=message)
+                            print('\t- Chatroom {} - new message #{}: \'{}\' - {}'.format(room_id, message['ordinal'], message['message'], self.get_time()))
 
-                            # check if the message is new
-                            if message['ordinal'] not in self.chat_state[room_id]['messages']:
-                                self.chat_state[room_id]['messages'][message['ordinal']] = message
-                                print('\t- Chatroom {} - new message #{}: \'{}\' - {}'.format(room_id, message['ordinal'], message['message'], self.get_time()))
-
-                                ##### You should call your agent here and get the response message #####
+                            ##### You should call your agent here and get the response message #####
 
-                                self.post_message(room_id=room_id, session_token=self.session_token, message='Got your message: \'{}\' at {}.'.format(message['message'], self.get_time()))
+                            self.post_message(room_id=room_id, session_token=self.session_token, message='Got your message: \'{}\' at {}.'.format(message['message'], self.get_time()))
             time.sleep(listen_freq)
 
+    def get_new_messages(self, room_id: str) -> list:
+        # Only ask for the messages from the last one seen in the room on, instead of the whole history
+        last_ordinal = self.chat_state[room_id]['last_ordinal']
+        messages = self.check_room_state(
+            room_id=room_id, since=max(last_ordinal, 0), session_token=self.session_token)['messages']
+
+        new_messages = sorted([message for message in messages if message['ordinal'] > last_ordinal],
+                              key=lambda message: message['ordinal'])
+        if len(new_messages) > 0:
+            self.chat_state[room_id]['last_ordinal'] = new_messages[-1]['ordinal']
+
+        return new_messages
+
+    def remember_message(self, room_id: str, message: dict):
+        # Keep a bounded window of the last messages of the room
+        messages = self.chat_state[room_id]['messages']
+        messages[message['ordinal']] = message
+        while len(messages) > max_messages_in_chat_state:
+            messages.popitem(last=False)
+
     def login(self, username: str, password: str):
-        agent_details = requests.post(url=url + "/api/login", json={"username": username, "password": password}).json()
+        agent_details = self.client.login()
         print('- User {} successfully logged in with session \'{}\'!'.format(agent_details['userDetails']['username'], agent_details['sessionToken']))
         return agent_details
 
+    # The client keeps the current session token (it logs in again if the session expires), so the session_token
+    #  arguments below are only kept for compatibility
     def check_rooms(self, session_token: str):
-        return requests.get(url=url + "/api/rooms", params={"session": session_token}).json()
+        return self.client.check_rooms()
 
     def check_room_state(self, room_id: str, since: int, session_token: str):
-        return requests.get(url=url + "/api/room/{}/{}".format(room_id, since), params={"roomId": room_id, "since": since, "session": session_token}).json()
+        return self.client.check_room_state(room_id=room_id, since=since)
 
     def post_message(self, room_id: str, session_token: str, message: str):
-        tmp_des = requests.post(url=url + "/api/room/{}".format(room_id),
-                                params={"roomId": room_id, "session": session_token}, data=message).json()
+        tmp_des = self.client.post_message(room_id=room_id, message=message)
         if tmp_des['description'] != 'Message received':
             print('\t\t Error: failed to post message: {}'.format(message))
 
@@ -77,8 +100,9 @@ class DemoBot:
         return time.strftime("%H:%M:%S, %d-%m-%Y", time.localtime())
 
     def logout(self):
-        if requests.get(url=url + "/api/logout", params={"session": self.session_token}).json()['description'] == 'Logged out':
-            print('- Session \'{}\' successfully logged out!'.format(self.session_token))
+        if self.client.logout()['description'] == 'Logged out':
+            print('- Session \'{}\' successfully logged out!'.format(self.client.session_token))
+        print('- Request times: {}'.format(self.client.request_stats()))
 
 
 if __name__ == '__main__':
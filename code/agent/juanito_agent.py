@@ -2,16 +2,26 @@ import os
 import time
 import json
 import random
+import asyncio
+import multiprocessing
+from typing import Optional
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 from knowledge_graphs.wikidata.WikiDataKG import WikiDataKG
 from models.entity_prop_parser.EntityPropertyParser import EntityPropertyParser
 from models.intent_classifier.InteractionTypeClassifier import InteractionTypeClassifier
+from models.intent_classifier.MicroBatchingClassifier import MicroBatchingClassifier
 from models.RedirectionAgent import RedirectionAgent
 from agent.demo_agent import DemoBot
+from agent.outgoing_message_queue import OutgoingMessageQueue
+from agent.polling_scheduler import PollingScheduler
 from regex_matchers.MediaQRegexMatcher import MediaQRegexMatcher
 from regex_matchers.FactQRegexMatcher import FactQRegexMatcher
 from regex_matchers.RecQRegexMatcher import RecQRegexMatcher
 from utils.utils import get_args_config_file
+from utils.response_cache import ResponseCache
+from utils.lazy_loader import LazyLoader
 
 # Load configurations
 config_args = get_args_config_file(os.path.join('..', 'config.yaml'))
@@ -21,23 +31,67 @@ crowd_sourcing_params = conversation_params['crowd_sourcing']
 first_funnel_config = conversation_params['first_funnel_info']
 
 url = config_args['chatroom_server']['url']  # url of the speakeasy server
-listen_freq = conversation_params['listen_freq']
+polling_params = conversation_params['polling']
+redirection_params = conversation_params['redirection_agent']
+concurrency_params = conversation_params['concurrency']
+
+# Bot used by the worker processes of JuanitoBot.listen_processes, created by each worker when it starts
+_worker_bot = None
+
+
+def _init_worker():
+    # Avoid oversubscribing the cores with the intra-op threads of torch in every worker
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    # The worker only computes responses, so its bot is never connected to the server
+    global _worker_bot
+    _worker_bot = JuanitoBot(username=None, password=None)
+    _worker_bot.wait_until_loaded()
+
+
+def _compute_responses_in_worker(message: str, room_id: str, intent: Optional[str]) -> list:
+    return _worker_bot.compute_responses(message, room_id, intent)
 
 
 class JuanitoBot(DemoBot):
     def __init__(self, username, password):
+        self._start_time = time.time()
+        self._time_to_first_response = None
         super().__init__(username, password)
-        self.first_funnel_filter = InteractionTypeClassifier(
-            train_examples_path=first_funnel_config['classifier_train_data'])
 
-        self.redirection_agent = RedirectionAgent()
-
-        self.entityParser = EntityPropertyParser(
+        # The models and the KG are created on first use, or in background threads if model_loading is 'background'.
+        #  Conversation messages are answered while the KG and the entity parser are still loading
+        self.first_funnel_filter = LazyLoader(lambda: InteractionTypeClassifier(
+            train_examples_path=first_funnel_config['classifier_train_data'],
+            mode=first_funnel_config['mode'], device=first_funnel_config['device'], head=first_funnel_config['head'],
+            head_cache_filepath=first_funnel_config['head_cache_filepath'], quantize=first_funnel_config['quantize'],
+            use_rule_router=first_funnel_config['use_rule_router'],
+            intent_cache=ResponseCache(**first_funnel_config['intent_cache'])), 'intent classifier')
+        # Messages classified concurrently by several threads are classified together
+        self._intent_batcher = MicroBatchingClassifier(
+            self.first_funnel_filter, max_batch_size=first_funnel_config['max_batch_size'],
+            max_wait=first_funnel_config['max_batch_wait'])
+
+        self.redirection_agent = LazyLoader(lambda: RedirectionAgent(
+            quantize=redirection_params['quantize'],
+            response_cache=ResponseCache(**redirection_params['response_cache'])), 'redirection agent')
+
+        self.entityParser = LazyLoader(lambda: EntityPropertyParser(
             entity_exact_label_filepath=conversation_params['entity_parser']['match_ent_labels_filepath'],
             property_extended_label_filepath=conversation_params['entity_parser']['match_prop_labels_filepath'],
-            model_type=conversation_params['entity_parser']['model_size'])
-
-        self.wkdata_kg = WikiDataKG(
+            model_type=conversation_params['entity_parser']['model_size'],
+            entity_linkers=tuple(conversation_params['entity_parser']['entity_linkers']),
+            entity_linker_configs={'local_entity_linker': {
+                'label_filepaths': [conversation_params['entity_parser']['match_ent_labels_filepath'],
+                                    wk_kg_params['entity_labels_dict']],
+                'label_file_weights': conversation_params['entity_parser']['local_linker_label_file_weights'],
+                'min_score': conversation_params['entity_parser']['local_linker_min_score']}}), 'entity parser')
+
+        self.wkdata_kg = LazyLoader(lambda: WikiDataKG(
             kg_tuple_file_path=wk_kg_params['kg_filepath'],
             imdb2movienet_filepath=wk_kg_params['imdb2movinet_filepath'],
             entity_label_filepath=wk_kg_params['entity_labels_dict'],
@@ -47,8 +101,22 @@ class JuanitoBot(DemoBot):
             entity_id_mapping=wk_kg_params['embeddings']['entity_id_mapping'],
             relation_emb=wk_kg_params['embeddings']['relation_emb'],
             relation_id_mapping=wk_kg_params['embeddings']['relation_id_mapping'],
-            recomendation_rules_filepath=wk_kg_params['recommendations']['rec_rules_filepath']
-        )
+            recomendation_rules_filepath=wk_kg_params['recommendations']['rec_rules_filepath'],
+            embedding_search_mode=wk_kg_params['embeddings']['search_mode'],
+            ann_index_filepath=wk_kg_params['embeddings']['ann_index_filepath'],
+            ann_nprobe=wk_kg_params['embeddings']['ann_nprobe'],
+            mmap_embeddings=wk_kg_params['embeddings']['mmap'],
+            embedding_storage_dtype=wk_kg_params['embeddings']['storage_dtype'],
+            kg_backend=wk_kg_params['kg_backend'],
+            kg_snapshot_dir=wk_kg_params['kg_snapshot_dir']
+        ), 'knowledge graph')
+
+        self._models = (self.first_funnel_filter, self.redirection_agent, self.entityParser, self.wkdata_kg)
+        if conversation_params['model_loading'] == 'background':
+            for model in self._models:
+                model.start()
+        elif conversation_params['model_loading'] == 'eager':
+            self.wait_until_loaded()
 
         self._template_answer = json.load(open(conversation_params['template_answer'], 'r'))
         self._template_rec_answer = json.load(open(conversation_params['recommendations']['rec_template_answer'], 'r'))
@@ -56,67 +124,287 @@ class JuanitoBot(DemoBot):
         self._fact_q_regex_matcher = FactQRegexMatcher()
         self._rec_q_regex_matcher = RecQRegexMatcher()
         self._crowd_source_dict = json.load(open(crowd_sourcing_params['filepath'], 'r'))
-        print('Ready to go!')
 
-    def listen(self):
-        while True:
-            # check for all chatrooms
-            current_rooms = self.check_rooms(session_token=self.session_token)['rooms']
-            for room in current_rooms:
-                # ignore finished conversations
-                if room['remainingTime'] > 0:
-                    room_id = room['uid']
-                    if not self.chat_state[room_id]['initiated']:
-                        # send a welcome message and get the alias of the agent in the chatroom
-                        self.post_message(
-                            room_id=room_id, session_token=self.session_token,
-                            message='Hi, how are you doing? If you have any questions about movies, please let me know')
-                        self.chat_state[room_id]['initiated'] = True
-                        self.chat_state[room_id]['my_alias'] = room['alias']
+        # Messages are posted in the background, in order per room
+        self._outgoing_messages = OutgoingMessageQueue(
+            send_fn=lambda room_id, message: super(JuanitoBot, self).post_message(
+                room_id=room_id, session_token=self.session_token, message=message))
 
-                    # check for all messages
-                    all_messages = self.check_room_state(
-                        room_id=room_id, since=0, session_token=self.session_token)['messages']
+        # Rooms with recent activity are polled quickly and idle or near-expired ones are backed off
+        self._polling_scheduler = PollingScheduler(**polling_params)
+        self._current_rooms = []
 
-                    # you can also use ["reactions"] to get the reactions of the messages: STAR, THUMBS_UP, THUMBS_DOWN
+        # When set, messages are collected here instead of posted (see compute_responses)
+        self._response_collector = None
+        print('Ready to go!')
 
-                    for message in all_messages:
-                        if message['authorAlias'] != self.chat_state[room_id]['my_alias']:
+    def wait_until_loaded(self):
+        for model in self._models:
+            model.get()
 
-                            # check if the message is new
-                            if message['ordinal'] not in self.chat_state[room_id]['messages']:
+    def post_message(self, room_id: str, session_token: str, message, coalesce: bool = True):
+        if self._response_collector is not None:
+            self._response_collector.append((message, coalesce))
+            return
 
-                                try:
-                                    # Add message to list of messages of the agent
-                                    self.chat_state[room_id]['messages'][message['ordinal']] = message
+        # Queue the message instead of waiting for it to be posted. Adjacent queued messages may be posted together
+        #  unless coalesce is False
+        self._outgoing_messages.put(room_id, message, coalesce)
+
+    def compute_responses(self, message: str, room_id: str, intent: Optional[str] = None) -> list:
+        """
+        Handle a message and return the (message, coalesce) pairs to post, instead of posting them
+        """
+        self._response_collector = []
+        try:
+            self._respond_to_message(message, room_id=room_id, intent=intent)
+            return self._response_collector
+        finally:
+            self._response_collector = None
+
+    def logout(self):
+        if not self._outgoing_messages.flush(timeout=concurrency_params['flush_timeout']):
+            print('- Some queued messages were not posted before logging out')
+        print('- Response latencies: {}'.format(self._polling_scheduler.latency_stats()))
+        print('- Intent classification batches: {}'.format(self._intent_batcher.stats()))
+        # Only the stats of the loaded models, as using the others would load them (or raise their loading error)
+        if self.first_funnel_filter.loaded_ok:
+            if self.first_funnel_filter.rule_router:
+                print('- Intents routed by rules: {}'.format(self.first_funnel_filter.rule_router.stats()))
+            print('- Intent cache: {}'.format(self.first_funnel_filter.intent_cache.stats()))
+        if self.redirection_agent.loaded_ok:
+            print('- Small talk cache: {}'.format(self.redirection_agent.response_cache.stats()))
+        super().logout()
 
-                                    # Classify the intent or type of interaction requested in the message
-                                    intent = self.first_funnel_filter(message['message'])
+    def listen(self):
+        while True:
+            new_room_messages = self._poll_new_room_messages()
+
+            # Classify the intents of all the new messages of this poll together
+            intents = self._classify_messages([message for _, message in new_room_messages])
+
+            for (room_id, message), intent in zip(new_room_messages, intents):
+                self._respond_to_message_and_record_latency(message, room_id=room_id, intent=intent)
+
+            time.sleep(self._polling_scheduler.time_until_next_poll())
+
+    def _poll_new_room_messages(self) -> list:
+        """
+        (room_id, message) pairs of the new messages of the rooms to poll. A failure to list or poll the rooms, after
+        the retries of the client, is logged and the rooms are polled again next time, so the bot keeps running
+        """
+        try:
+            rooms_to_poll = self._rooms_to_poll()
+        except Exception as e:
+            print(e)
+            return []
+
+        new_room_messages = []
+        for room in rooms_to_poll:
+            try:
+                self._initiate_room(room)
+
+                # check for the new messages
+                new_room_messages += [(room['uid'], message) for message in self._get_new_user_messages(room)]
+            except Exception as e:
+                print(e)
+
+        return new_room_messages
+
+    def _classify_messages(self, messages: list) -> list:
+        if len(messages) == 0:
+            return []
+
+        try:
+            return self.first_funnel_filter.classify_batch([message['message'] for message in messages])
+        except Exception as e:
+            # Let each message be classified on its own while it is handled
+            print(e)
+            return [None] * len(messages)
+
+    def _rooms_to_poll(self) -> list:
+        # check for all chatrooms every now and then, ignoring finished conversations
+        if self._polling_scheduler.should_check_rooms():
+            self._current_rooms = [room for room in self.check_rooms(session_token=self.session_token)['rooms']
+                                   if room['remainingTime'] > 0]
+
+        return self._polling_scheduler.rooms_to_poll(self._current_rooms)
+
+    def _get_new_user_messages(self, room: dict) -> list:
+        room_id = room['uid']
+        # you can also use ["reactions"] to get the reactions of the messages: STAR, THUMBS_UP, THUMBS_DOWN
+        new_messages = [message for message in self.get_new_messages(room_id=room_id)
+                        if message['authorAlias'] != self.chat_state[room_id]['my_alias']]
+
+        # Add messages to list of messages of the agent
+        for message in new_messages:
+            message['receivedAt'] = time.time()
+            self.remember_message(room_id=room_id, message=message)
+
+        self._polling_scheduler.record_poll(room_id, len(new_messages), room['remainingTime'])
+
+        return new_messages
+
+    def _respond_to_message_and_record_latency(self, message: dict, room_id: str, intent: Optional[str] = None):
+        self._respond_to_message(message['message'], room_id=room_id, intent=intent)
+        self._record_latency(message)
+
+    def _record_latency(self, message: dict):
+        # Latency from the time the message was sent (if the server reports it, in ms) or received
+        sent_at = message['timeStamp'] / 1000 if isinstance(message.get('timeStamp'), (int, float)) \
+            else message['receivedAt']
+        self._polling_scheduler.record_response_latency(time.time() - sent_at)
+
+        if self._time_to_first_response is None:
+            self._time_to_first_response = time.time() - self._start_time
+            print(f'- Time to first response since startup: {self._time_to_first_response:.1f} s')
+
+    def listen_async(self):
+        asyncio.run(self._listen_async())
+
+    async def _listen_async(self):
+        """
+        Poll the rooms, and handle and answer the messages of each room concurrently with the other rooms.
+        Messages of the same room are answered in order. The model and KG calls run in a bounded thread pool,
+        and the HTTP calls to the server in a separate one, so polling is never blocked by a heavy request.
+        """
+        loop = asyncio.get_running_loop()
+        model_executor = ThreadPoolExecutor(max_workers=concurrency_params['max_workers'])
+        http_executor = ThreadPoolExecutor(max_workers=concurrency_params['max_http_workers'])
+        # Queue of the messages of each room and task answering them. A task ends, and both are removed, when its
+        #  queue is empty, so idle and expired rooms do not keep them
+        room_queues = {}
+        room_tasks = {}
+
+        async def handle_room_messages(room_id: str):
+            room_queue = room_queues[room_id]
+            while not room_queue.empty():
+                message = room_queue.get_nowait()
+                try:
+                    await loop.run_in_executor(
+                        model_executor, self._respond_to_message_and_record_latency, message, room_id)
+                except Exception as e:
+                    print(e)
+
+            # No await since the queue was found empty, so no message can be queued in between
+            del room_queues[room_id]
+            del room_tasks[room_id]
+
+        async def poll_room(room: dict):
+            room_id = room['uid']
+            await loop.run_in_executor(http_executor, self._initiate_room, room)
+            new_messages = await loop.run_in_executor(http_executor, self._get_new_user_messages, room)
+
+            for message in new_messages:
+                if room_id not in room_queues:
+                    room_queues[room_id] = asyncio.Queue()
+                    room_tasks[room_id] = loop.create_task(handle_room_messages(room_id))
+                room_queues[room_id].put_nowait(message)
 
-                                    if intent == "Conversation":
-                                        self._respond_with_conversation(message['message'], room_id=room_id)
+        while True:
+            try:
+                rooms_to_poll = await loop.run_in_executor(http_executor, self._rooms_to_poll)
+            except Exception as e:
+                # Try again on the next poll
+                print(e)
+                rooms_to_poll = []
+
+            # A room failing to be polled does not stop the others, nor the loop
+            for result in await asyncio.gather(*[poll_room(room) for room in rooms_to_poll], return_exceptions=True):
+                if isinstance(result, Exception):
+                    print(result)
+
+            await asyncio.sleep(self._polling_scheduler.time_until_next_poll())
+
+    def listen_processes(self):
+        """
+        Poll the rooms in this process and handle the messages in a pool of worker processes, posting the responses
+        of each room in the order of its messages.
+
+        The workers are started with `concurrency.start_method` ('spawn' or 'forkserver') and load their own models
+        and KG. Forking this process is unsafe, as it already runs threads (model loading, outgoing messages, intent
+        batching, torch) whose locks could be copied while held. Only the memory-mapped compiled KG and embeddings
+        are shared by the OS, so each worker adds the memory of the models: use this mode only where it was
+        measured to answer faster than 'async'.
+        """
+        pending_responses = defaultdict(deque)
+
+        with multiprocessing.get_context(concurrency_params['start_method']).Pool(
+                concurrency_params['num_processes'], initializer=_init_worker) as pool:
+            while True:
+                new_room_messages = self._poll_new_room_messages()
+
+                # Classify the intents of all the new messages of this poll together, before sending them to the workers
+                intents = self._classify_messages([message for _, message in new_room_messages])
+
+                for (room_id, message), intent in zip(new_room_messages, intents):
+                    pending_responses[room_id].append((message, pool.apply_async(
+                        _compute_responses_in_worker, (message['message'], room_id, intent))))
+
+                # Post the responses that are ready, in the order of the messages of each room
+                for room_id, room_pending_responses in pending_responses.items():
+                    while len(room_pending_responses) > 0 and room_pending_responses[0][1].ready():
+                        message, responses = room_pending_responses.popleft()
+                        try:
+                            for response, coalesce in responses.get():
+                                self.post_message(room_id=room_id, session_token=self.session_token,
+                                                  message=response, coalesce=coalesce)
+                        except Exception as e:
+                            print(e)
+                            self.post_message(room_id=room_id, session_token=self.session_token,
+                                              message=self._sample_template_answer("overall_failure"))
+                        self._record_latency(message)
+
+                # Check often for finished responses while some are pending
+                time.sleep(min(self._polling_scheduler.time_until_next_poll(), 0.05)
+                           if any(len(room_pending) > 0 for room_pending in pending_responses.values())
+                           else self._polling_scheduler.time_until_next_poll())
+
+    def _initiate_room(self, room: dict):
+        room_id = room['uid']
+        if not self.chat_state[room_id]['initiated']:
+            # send a welcome message and get the alias of the agent in the chatroom
+            self.post_message(
+                room_id=room_id, session_token=self.session_token,
+                message='Hi, how are you doing? If you have any questions about movies, please let me know')
+            self.chat_state[room_id]['initiated'] = True
+            self.chat_state[room_id]['my_alias'] = room['alias']
+
+    def _respond_to_message(self, message: str, room_id: str, intent: Optional[str] = None):
+        try:
+            # Classify the intent or type of interaction requested in the message, if it was not classified
+            #  in a batch already
+            intent = intent or self._intent_batcher(message)
+
+            # Let the user know the answer will wait until the KG and the entity parser are loaded
+            if intent != "Conversation" and not (self.wkdata_kg.is_loaded and self.entityParser.is_loaded):
+                self.post_message(room_id=room_id, session_token=self.session_token,
+                                  message=self._sample_template_answer('still_loading'))
 
-                                    elif intent == "Factual Question/Embedding/Crowdsourcing":
-                                        self._respond_kg_question(message['message'], room_id=room_id)
+            if intent == "Conversation":
+                self._respond_with_conversation(message, room_id=room_id)
 
-                                    elif intent == "Media Question":
-                                        self._respond_media_request(message['message'], room_id=room_id)
+            elif intent == "Factual Question/Embedding/Crowdsourcing":
+                self._respond_kg_question(message, room_id=room_id)
 
-                                    elif intent == 'Recommendation Questions':
-                                        self._respond_with_recommendation(message=message['message'], room_id=room_id)
+            elif intent == "Media Question":
+                self._respond_media_request(message, room_id=room_id)
 
-                                except Exception as e:
-                                    print(e)
-                                    self.post_message(room_id=room_id, session_token=self.session_token,
-                                                      message=self._sample_template_answer("overall_failure"))
+            elif intent == 'Recommendation Questions':
+                self._respond_with_recommendation(message=message, room_id=room_id)
 
-            time.sleep(listen_freq)
+        except Exception as e:
+            print(e)
+            self.post_message(room_id=room_id, session_token=self.session_token,
+                              message=self._sample_template_answer("overall_failure"))
 
     def _find_wikidata_entity_id_of_movies_in_string(self, message: str) -> list[str]:
         movie_wk_ent_id_list = []
+        analysis = self.entityParser.analyze(message)
+
         # Use entity linker to find named entities of interest and their respective wikidata ids
         spacy_ents, wkdata_ents = self.entityParser.return_wikidata_entities_w_entity_linkers(
-            message, entities_of_interest=("WORK_OF_ART",), entity_filter=self.wkdata_kg.check_if_entity_is_movie)
+            analysis, entities_of_interest=("WORK_OF_ART",), entity_filter=self.wkdata_kg.check_if_entity_is_movie)
 
         # Filter matched entities so far
         wkdata_ents = [wkdata_ent for wkdata_ent in wkdata_ents if
@@ -144,15 +432,25 @@ class JuanitoBot(DemoBot):
         return movie_wk_ent_id_list
 
     def _respond_with_conversation(self, message: str, room_id: str):
-        self.post_message(room_id=room_id, session_token=self.session_token,
-                          message=self.redirection_agent.small_talk_and_redirect_conversation(message))
+        if not redirection_params['stream']:
+            self.post_message(room_id=room_id, session_token=self.session_token,
+                              message=self.redirection_agent.small_talk_and_redirect_conversation(message))
+            return
+
+        # Post each sentence of the response as soon as it is generated
+        for sentence in self.redirection_agent.small_talk_and_redirect_conversation_stream(message):
+            if sentence.strip() != '':
+                self.post_message(room_id=room_id, session_token=self.session_token, message=sentence.strip())
 
     def _respond_kg_question(self, message: str, room_id: str):
         wk_ent_id = None
         wk_prop_id = None
 
+        # Parse the message once for the property and entity extraction
+        analysis = self.entityParser.analyze(message)
+
         # Use phrasematcher on entire string to detect properties
-        wk_prop_ids = self.entityParser.return_wikidata_properties(doc=message)
+        wk_prop_ids = self.entityParser.return_wikidata_properties(doc=analysis)
 
         # Only assign the entity if only one property is matched, otherwise it is too noisy
         if len(wk_prop_ids) == 1:
@@ -160,7 +458,7 @@ class JuanitoBot(DemoBot):
 
         # Use spacy entity linkers to identify entities
         spacy_ents, wkdata_ents = self.entityParser.return_wikidata_entities_w_entity_linkers(
-            doc=message, entities_of_interest=("PERSON", "WORK_OF_ART"),
+            doc=analysis, entities_of_interest=("PERSON", "WORK_OF_ART"),
             entity_filter=self.wkdata_kg.check_if_entity_movie_or_person)
 
         # If no entities were detected, then try to identify them via named entities detected
@@ -323,9 +621,13 @@ class JuanitoBot(DemoBot):
         return False
 
     def _respond_media_request(self, message: str, room_id: str):
-        # Use entity linker to find named entities of interest and their respective wikidata ids
+        # Parse the message once for the entity extraction and the regex matcher
+        analysis = self.entityParser.analyze(message)
+
+        # Use the named entity recognizer and exact matches to find named entities of interest and their respective
+        #  wikidata ids. The entity linkers are skipped, the PERSON entities are matched to the KG labels below
         spacy_ents, wkdata_ents = self.entityParser.return_wikidata_entities_w_entity_linkers(
-            message, entities_of_interest=('PERSON',))
+            analysis, entities_of_interest=('PERSON',), use_entity_linkers=False)
 
         # Try to get imdb_id of PERSON entities successfully linked to wikidata
         imdb_ids = []
@@ -348,7 +650,7 @@ class JuanitoBot(DemoBot):
 
         # If still no imdb ids where found, use regex patterns to extract relevant text and match to a KG entity label
         if len(imdb_ids) == 0:
-            extracted_str = self._media_q_regex_matcher.match_string(message)
+            extracted_str = self._media_q_regex_matcher.match_string(message, analysis)
             wk_ent_id = self.wkdata_kg.get_wkdata_entid_based_on_label_match(extracted_str, ent_type='person') \
                 if extracted_str else None
             imdb_id = self.wkdata_kg.get_imdb_id(wk_ent_id=wk_ent_id) if wk_ent_id else None
@@ -367,13 +669,15 @@ class JuanitoBot(DemoBot):
         movienet_ids = [self.wkdata_kg.get_movinet_id(imdb_id) for imdb_id in imdb_ids
                         if self.wkdata_kg.get_movinet_id(imdb_id) is not None]
         if len(movienet_ids) == 1:
-            self.post_message(room_id=room_id, session_token=self.session_token, message=f'image:{movienet_ids[0]}')
+            self.post_message(room_id=room_id, session_token=self.session_token, message=f'image:{movienet_ids[0]}',
+                              coalesce=False)
 
         else:
             self.post_message(room_id=room_id, session_token=self.session_token,
                               message='I found these photos of the people you mentioned ')
             for movienet_id in movienet_ids:
-                self.post_message(room_id=room_id, session_token=self.session_token, message=f'image:{movienet_id}')
+                self.post_message(room_id=room_id, session_token=self.session_token, message=f'image:{movienet_id}',
+                                  coalesce=False)
 
     def _respond_with_recommendation(self, message: str, room_id: str):
         movie_wk_ent_id = self._find_wikidata_entity_id_of_movies_in_string(message)
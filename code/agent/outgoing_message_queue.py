@@ -0,0 +1,87 @@
+import time
+import queue
+import threading
+from typing import Callable, Optional, Union
+
+
+class OutgoingMessageQueue:
+    """
+    Queue of the messages to post in each room, sent in order by one background thread per room, so answering a
+    message does not wait for the network round trips of its posts.
+
+    Messages that pile up in a room while a post is in flight are coalesced into a single post (separated by new
+    lines), unless they were queued with `coalesce=False` (e.g. images, which must be posted on their own).
+    The thread of a room exits after `idle_timeout` seconds without messages, and is started again by the next one.
+    """
+    def __init__(self, send_fn: Callable[[str, bytes], None], max_coalesced_messages: int = 5,
+                 idle_timeout: float = 30):
+        self.send_fn = send_fn
+        self.max_coalesced_messages = max_coalesced_messages
+        self.idle_timeout = idle_timeout
+        self._room_queues = {}
+        self._lock = threading.Lock()
+
+    def put(self, room_id: str, message: Union[str, bytes], coalesce: bool = True) -> None:
+        message = message.encode('utf-8') if isinstance(message, str) else message
+
+        # Queued under the lock, so the thread of the room cannot exit in between (see _send_room_messages)
+        with self._lock:
+            if room_id not in self._room_queues:
+                self._room_queues[room_id] = queue.Queue()
+                threading.Thread(target=self._send_room_messages, args=(room_id, self._room_queues[room_id]),
+                                 daemon=True).start()
+
+            self._room_queues[room_id].put((message, coalesce))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all the queued messages are sent, or at most `timeout` seconds. Return whether they were all sent
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            room_queues = list(self._room_queues.values())
+
+        for room_queue in room_queues:
+            with room_queue.all_tasks_done:
+                while room_queue.unfinished_tasks:
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    room_queue.all_tasks_done.wait(remaining)
+
+        return True
+
+    def _send_room_messages(self, room_id: str, room_queue: queue.Queue):
+        while True:
+            try:
+                message, coalesce = room_queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Exit if no message was queued meanwhile, otherwise keep sending
+                with self._lock:
+                    if room_queue.empty():
+                        del self._room_queues[room_id]
+                        return
+                continue
+
+            num_messages = 1
+
+            # Coalesce the messages that are already waiting, until one that cannot be coalesced
+            while coalesce and num_messages < self.max_coalesced_messages:
+                with room_queue.mutex:
+                    if len(room_queue.queue) == 0:
+                        break
+                    next_message, next_coalesce = room_queue.queue[0]
+                if not next_coalesce:
+                    break
+
+                room_queue.get_nowait()
+                message = message + b'\n' + next_message
+                num_messages += 1
+
+            try:
+                self.send_fn(room_id, message)
+            except Exception as e:
+                print('\t\t Error: failed to post message: {} ({})'.format(message, e))
+            finally:
+                for _ in range(num_messages):
+                    room_queue.task_done()
@@ -0,0 +1,85 @@
+import time
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class PollingScheduler:
+    """
+    Decides when to poll each room for new messages, instead of polling all of them after a fixed sleep.
+
+    A room with new messages is polled again after `min_interval` seconds. Every poll without new messages
+    multiplies the interval of the room by `backoff_factor`, up to `max_interval`. Rooms whose `remainingTime` is
+    below `near_expiry_remaining_time` are polled every `max_interval`. The list of rooms is refreshed every
+    `room_list_interval` seconds, and the rooms no longer in it are forgotten. It also keeps the response latencies
+    of the bot.
+    """
+    def __init__(self, min_interval: float = 0.5, max_interval: float = 10, backoff_factor: float = 1.5,
+                 room_list_interval: float = 5, near_expiry_remaining_time: float = 60, max_latencies: int = 1000):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.room_list_interval = room_list_interval
+        self.near_expiry_remaining_time = near_expiry_remaining_time
+        self.max_latencies = max_latencies
+
+        self._room_intervals = {}
+        self._room_next_poll = {}
+        self._next_room_list_check = 0
+        self._latencies = []
+        # Rooms are polled and recorded from several threads in the async mode
+        self._lock = threading.Lock()
+
+    def should_check_rooms(self, now: Optional[float] = None) -> bool:
+        now = now or time.time()
+        if now >= self._next_room_list_check:
+            self._next_room_list_check = now + self.room_list_interval
+            return True
+
+        return False
+
+    def rooms_to_poll(self, rooms: list, now: Optional[float] = None) -> list:
+        now = now or time.time()
+        with self._lock:
+            # Forget the rooms that expired or left, so their past poll times do not shorten the sleep
+            active_room_ids = {room['uid'] for room in rooms}
+            for room_id in [room_id for room_id in self._room_next_poll if room_id not in active_room_ids]:
+                del self._room_next_poll[room_id]
+                self._room_intervals.pop(room_id, None)
+
+            return [room for room in rooms if now >= self._room_next_poll.get(room['uid'], 0)]
+
+    def record_poll(self, room_id: str, num_new_messages: int, remaining_time: float, now: Optional[float] = None):
+        now = now or time.time()
+
+        if remaining_time < self.near_expiry_remaining_time:
+            interval = self.max_interval
+        elif num_new_messages > 0:
+            interval = self.min_interval
+        else:
+            interval = min(self._room_intervals.get(room_id, self.min_interval) * self.backoff_factor,
+                           self.max_interval)
+
+        with self._lock:
+            self._room_intervals[room_id] = interval
+            self._room_next_poll[room_id] = now + interval
+
+    def time_until_next_poll(self, now: Optional[float] = None) -> float:
+        now = now or time.time()
+        with self._lock:
+            next_poll = min([self._next_room_list_check, *self._room_next_poll.values()])
+        return min(max(next_poll - now, self.min_interval), self.max_interval)
+
+    def record_response_latency(self, latency: float):
+        self._latencies = self._latencies[-(self.max_latencies - 1):] + [latency]
+
+    def latency_stats(self) -> dict:
+        """
+        Number, mean, median and 95th percentile in seconds of the last response latencies
+        """
+        if len(self._latencies) == 0:
+            return {'count': 0}
+
+        return {'count': len(self._latencies), 'mean': float(np.mean(self._latencies)),
+                'p50': float(np.percentile(self._latencies, 50)), 'p95': float(np.percentile(self._latencies, 95))}
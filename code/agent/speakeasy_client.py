@@ -0,0 +1,143 @@
+import time
+import threading
+from collections import defaultdict
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses to a request with an expired or invalid session, after which it is retried logging in again
+reauth_status_codes = (401, 403)
+# Responses retried for the idempotent (GET) requests
+retry_status_codes = (500, 502, 503, 504)
+
+
+class SpeakeasyClient:
+    """
+    HTTP client of the Speakeasy server over persistent sessions, so connections are pooled and kept alive.
+
+    requests.Session is not documented as thread-safe, so each thread uses its own session. Failed requests are
+    retried here (and only here) with exponential backoff: GET requests on connection errors, timeouts and 5xx
+    responses, POST requests only on connection errors (refused, reset or not established), not on read timeouts
+    or 5xx responses, as then the server might have received them and the message would be posted twice. Requests
+    rejected as unauthorized (401/403) are retried after logging in again. The number, total and max time of the
+    requests are kept per endpoint.
+    """
+    def __init__(self, url: str, username: str, password: str,
+                 timeout: float = 10, max_retries: int = 5, backoff_factor: float = 0.5, pool_maxsize: int = 16):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
+        self.session_token = None
+
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._request_times = defaultdict(lambda: {'count': 0, 'total_time': 0., 'max_time': 0.})
+        self._request_times_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        # Session of the calling thread, created on its first request
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+
+        return session
+
+    @staticmethod
+    def _is_retryable(e: Exception, method: str) -> bool:
+        if isinstance(e, requests.HTTPError):
+            status_code = e.response.status_code
+            return status_code in reauth_status_codes or (method == 'GET' and status_code in retry_status_codes)
+
+        if method == 'GET':
+            return True
+
+        # The connection failed, as opposed to a read timeout after the request was sent
+        return isinstance(e, requests.ConnectionError)
+
+    def _request(self, endpoint: str, method: str, path: str, params: Optional[dict] = None,
+                 with_session: bool = True, **kwargs) -> dict:
+        for attempt in range(self.max_retries + 1):
+            try:
+                start = time.perf_counter()
+                response = self.session.request(
+                    method, self.url + path, timeout=self.timeout,
+                    params={**(params or {}), **({'session': self.session_token} if with_session else {})},
+                    **kwargs)
+                self._record_request_time(endpoint, time.perf_counter() - start)
+
+                response.raise_for_status()
+                return response.json()
+
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.max_retries or not self._is_retryable(e, method):
+                    raise e
+
+                print(f'\t\t Error: request to {endpoint} failed ({e}), retrying')
+                time.sleep(self.backoff_factor * 2 ** attempt)
+
+                # The session expired, log in again before retrying
+                if with_session and isinstance(e, requests.HTTPError) and \
+                        e.response.status_code in reauth_status_codes:
+                    try:
+                        self.login()
+                    except (requests.RequestException, ValueError, KeyError):
+                        pass
+
+    def _record_request_time(self, endpoint: str, request_time: float) -> None:
+        with self._request_times_lock:
+            endpoint_times = self._request_times[endpoint]
+            endpoint_times['count'] += 1
+            endpoint_times['total_time'] += request_time
+            endpoint_times['max_time'] = max(endpoint_times['max_time'], request_time)
+
+    def login(self) -> dict:
+        agent_details = self._request('login', 'POST', '/api/login', with_session=False,
+                                      json={"username": self.username, "password": self.password})
+        self.session_token = agent_details['sessionToken']
+        return agent_details
+
+    def check_rooms(self) -> dict:
+        return self._request('rooms', 'GET', '/api/rooms')
+
+    def check_room_state(self, room_id: str, since: int) -> dict:
+        return self._request('room_state', 'GET', "/api/room/{}/{}".format(room_id, since),
+                             params={"roomId": room_id, "since": since})
+
+    def post_message(self, room_id: str, message: str) -> dict:
+        return self._request('post_message', 'POST', "/api/room/{}".format(room_id),
+                             params={"roomId": room_id}, data=message)
+
+    def logout(self) -> dict:
+        response = self._request('logout', 'GET', '/api/logout')
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._local = threading.local()
+
+        return response
+
+    def request_stats(self) -> dict:
+        """
+        Number of requests, and mean and max time in seconds of the requests to each endpoint
+        """
+        with self._request_times_lock:
+            return {
+                endpoint: {'count': times['count'], 'mean_time': times['total_time'] / times['count'],
+                           'max_time': times['max_time']}
+                for endpoint, times in self._request_times.items()
+            }
@@ -6,6 +6,8 @@ from typing import Tuple, Any, Optional
 
 import rdflib
 
+from knowledge_graphs.CompiledGraph import compile_kg_graph, check_if_snapshot_exists, load_compiled_kg_graph
+
 
 class Namespaces:
     def __init__(self):
@@ -26,6 +28,23 @@ def parse_kg_graph(kg_tuple_file_path: str):
     return graph
 
 
+def load_kg_graph(kg_tuple_file_path: str, kg_backend: str = 'rdflib', kg_snapshot_dir: Optional[str] = None):
+    if kg_backend == 'rdflib':
+        return parse_kg_graph(kg_tuple_file_path)
+
+    elif kg_backend == 'compiled':
+        if not kg_snapshot_dir:
+            raise ValueError("The 'compiled' KG backend needs a kg_snapshot_dir in the configuration")
+
+        # Use the compiled snapshot of the KG, compiling it first if it does not exist yet
+        if not check_if_snapshot_exists(kg_snapshot_dir):
+            compile_kg_graph(parse_kg_graph(kg_tuple_file_path), kg_snapshot_dir)
+
+        return load_compiled_kg_graph(kg_snapshot_dir)
+
+    raise ValueError(f'Unknown KG backend: {kg_backend}')
+
+
 def _load_entity_or_property_labels_from_json(filepath: str):
     return json.load(open(filepath, 'r'))
 
@@ -34,8 +53,10 @@ class BasicKG:
     def __init__(self,
                  kg_tuple_file_path: str,
                  entity_label_filepath: Optional[str] = None,
-                 property_label_filepath: Optional[str] = None):
-        self.kg = parse_kg_graph(kg_tuple_file_path)
+                 property_label_filepath: Optional[str] = None,
+                 kg_backend: str = 'rdflib',
+                 kg_snapshot_dir: Optional[str] = None):
+        self.kg = load_kg_graph(kg_tuple_file_path, kg_backend, kg_snapshot_dir)
         print("KG loaded")
         self.namespaces = Namespaces()
         self.entity_labels_dict = self._extract_entity_labels_dict() if entity_label_filepath is None \
@@ -0,0 +1,250 @@
+import json
+import os
+import sys
+import hashlib
+from functools import lru_cache
+from typing import Optional, List
+
+import numpy as np
+import rdflib
+from rdflib.store import Store
+from rdflib.util import from_n3
+from tqdm import tqdm
+
+# Term dictionary: the UTF-8 N3 strings of the terms concatenated in a blob with the offsets of each term, and the
+#  64 bit hashes of the terms sorted, with the id of the term of each hash
+term_filenames = {'blob': 'terms_blob.npy', 'offsets': 'term_offsets.npy', 'hashes': 'term_hashes.npy',
+                  'hash_ids': 'term_hash_ids.npy'}
+# Term dictionary of the snapshots compiled before, converted to the current one on load
+legacy_terms_filename = 'terms.json'
+column_filenames = {'s': 'subjects.npy', 'p': 'predicates.npy', 'o': 'objects.npy'}
+index_filenames = {'subject_offsets': 'subject_offsets.npy', 'pos_order': 'pos_order.npy',
+                   'pos_objects': 'pos_objects.npy', 'predicate_offsets': 'predicate_offsets.npy'}
+
+
+def _csr_offsets(sorted_ids: np.ndarray, num_terms: int) -> np.ndarray:
+    # The rows of term i in an array sorted by term id are offsets[i]: offsets[i + 1]
+    offsets = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sorted_ids, minlength=num_terms), out=offsets[1:])
+    return offsets
+
+
+def _term_hash(term_n3: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term_n3.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def save_term_dictionary(terms: List[str], snapshot_dir: str) -> None:
+    encoded_terms = [term.encode('utf-8') for term in terms]
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(encoded_term) for encoded_term in encoded_terms], out=offsets[1:])
+    hashes = np.fromiter((_term_hash(term) for term in terms), dtype=np.uint64, count=len(terms))
+    hash_ids = np.argsort(hashes, kind='stable').astype(np.int32)
+
+    term_arrays = {'blob': np.frombuffer(b''.join(encoded_terms), dtype=np.uint8), 'offsets': offsets,
+                   'hashes': hashes[hash_ids], 'hash_ids': hash_ids}
+    for name, term_array in term_arrays.items():
+        np.save(os.path.join(snapshot_dir, term_filenames[name]), term_array)
+
+
+def build_snapshot_indexes(snapshot_dir: str) -> None:
+    """
+    Build the adjacency indexes of a snapshot: CSR offsets of the subjects over the SPO-sorted triples, and the
+    permutation of the triples in POS order with the objects in that order and the CSR offsets of the predicates
+    """
+    num_terms = len(np.load(os.path.join(snapshot_dir, term_filenames['offsets']), mmap_mode='r')) - 1
+    s, p, o = [np.load(os.path.join(snapshot_dir, column_filenames[position])) for position in ('s', 'p', 'o')]
+
+    pos_order = np.lexsort((s, o, p)).astype(np.int32)
+    indexes = {
+        'subject_offsets': _csr_offsets(s, num_terms),
+        'pos_order': pos_order,
+        'pos_objects': np.ascontiguousarray(o[pos_order]),
+        'predicate_offsets': _csr_offsets(p[pos_order], num_terms)
+    }
+
+    for name, index in indexes.items():
+        np.save(os.path.join(snapshot_dir, index_filenames[name]), index)
+
+
+def compile_kg_graph(graph: rdflib.Graph, snapshot_dir: str) -> None:
+    """
+    Convert a graph into a compiled snapshot: a dictionary of the terms (in N3 notation) and one integer array per
+    position of the triples (subject, predicate, object), sorted in SPO order
+    """
+    term2id = {}
+
+    def encode(term) -> int:
+        return term2id.setdefault(term.n3(), len(term2id))
+
+    triples = np.array([(encode(s), encode(p), encode(o)) for s, p, o in tqdm(graph)], dtype=np.int32)
+    triples = triples[np.lexsort((triples[:, 2], triples[:, 1], triples[:, 0]))]
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for col, position in enumerate(('s', 'p', 'o')):
+        np.save(os.path.join(snapshot_dir, column_filenames[position]), np.ascontiguousarray(triples[:, col]))
+
+    save_term_dictionary(list(term2id.keys()), snapshot_dir)
+    build_snapshot_indexes(snapshot_dir)
+
+
+def _check_if_files_exist(snapshot_dir: str, filenames) -> bool:
+    return all(os.path.exists(os.path.join(snapshot_dir, filename)) for filename in filenames)
+
+
+def check_if_snapshot_exists(snapshot_dir: str) -> bool:
+    return _check_if_files_exist(snapshot_dir, column_filenames.values()) and (
+        _check_if_files_exist(snapshot_dir, term_filenames.values()) or
+        _check_if_files_exist(snapshot_dir, (legacy_terms_filename,)))
+
+
+class CompiledStore(Store):
+    """
+    Read-only rdflib store backed by a compiled snapshot. The integer arrays and the term dictionary are
+    memory-mapped. A term is encoded with a binary search of its hash, and only decoded when a triple that
+    contains it is returned (the last `decode_cache_size` decoded terms are cached).
+
+    Patterns with a bound subject are resolved with the SPO index and patterns with a bound predicate with the
+    POS index, both with CSR offsets plus a binary search. Only patterns with just the object bound scan the arrays.
+    """
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, snapshot_dir: str, decode_cache_size: int = 2 ** 18):
+        super().__init__()
+        # Snapshots compiled with the JSON term dictionary get it converted on load
+        if not _check_if_files_exist(snapshot_dir, term_filenames.values()):
+            with open(os.path.join(snapshot_dir, legacy_terms_filename), 'r') as ifile:
+                save_term_dictionary(json.load(ifile), snapshot_dir)
+
+        self._term_blob, self._term_offsets, self._term_hashes, self._term_hash_ids = [
+            np.load(os.path.join(snapshot_dir, term_filenames[name]), mmap_mode='r')
+            for name in ('blob', 'offsets', 'hashes', 'hash_ids')
+        ]
+        self._decode = lru_cache(maxsize=decode_cache_size)(self._decode_term)
+
+        self._s, self._p, self._o = [np.load(os.path.join(snapshot_dir, column_filenames[position]), mmap_mode='r')
+                                     for position in ('s', 'p', 'o')]
+
+        # Snapshots compiled before the indexes were introduced get them built on load
+        if not all(os.path.exists(os.path.join(snapshot_dir, filename)) for filename in index_filenames.values()):
+            build_snapshot_indexes(snapshot_dir)
+
+        self._subject_offsets, self._pos_order, self._pos_objects, self._predicate_offsets = [
+            np.load(os.path.join(snapshot_dir, index_filenames[name]), mmap_mode='r')
+            for name in ('subject_offsets', 'pos_order', 'pos_objects', 'predicate_offsets')
+        ]
+
+        self._namespaces = {}
+        self._prefixes = {}
+
+    def _get_term_n3(self, term_id: int) -> str:
+        return bytes(self._term_blob[self._term_offsets[term_id]: self._term_offsets[term_id + 1]]).decode('utf-8')
+
+    def _encode(self, term) -> Optional[int]:
+        term_n3 = term.n3()
+        term_hash = np.uint64(_term_hash(term_n3))
+        lo = int(np.searchsorted(self._term_hashes, term_hash, side='left'))
+        hi = int(np.searchsorted(self._term_hashes, term_hash, side='right'))
+
+        # Compare the strings in case different terms share the hash
+        for term_id in self._term_hash_ids[lo: hi].tolist():
+            if self._get_term_n3(term_id) == term_n3:
+                return term_id
+
+        return None
+
+    def _decode_term(self, term_id: int):
+        return from_n3(self._get_term_n3(int(term_id)))
+
+    def _match_rows(self, s_id: Optional[int], p_id: Optional[int], o_id: Optional[int]):
+        if s_id is not None:
+            # SPO index: the rows of the subject are contiguous, and sorted by predicate and object within them
+            lo, hi = int(self._subject_offsets[s_id]), int(self._subject_offsets[s_id + 1])
+            if p_id is not None:
+                lo, hi = lo + np.searchsorted(self._p[lo: hi], p_id, side='left'), \
+                         lo + np.searchsorted(self._p[lo: hi], p_id, side='right')
+                if o_id is not None:
+                    lo, hi = lo + np.searchsorted(self._o[lo: hi], o_id, side='left'), \
+                             lo + np.searchsorted(self._o[lo: hi], o_id, side='right')
+                return range(lo, hi)
+
+            rows = np.arange(lo, hi)
+            return rows if o_id is None else rows[self._o[lo: hi] == o_id]
+
+        if p_id is not None:
+            # POS index: the rows of the predicate are contiguous in POS order, and sorted by object within them
+            lo, hi = int(self._predicate_offsets[p_id]), int(self._predicate_offsets[p_id + 1])
+            if o_id is not None:
+                lo, hi = lo + np.searchsorted(self._pos_objects[lo: hi], o_id, side='left'), \
+                         lo + np.searchsorted(self._pos_objects[lo: hi], o_id, side='right')
+            return self._pos_order[lo: hi]
+
+        if o_id is None:
+            return range(len(self._s))
+
+        return np.nonzero(self._o == o_id)[0]
+
+    def all_node_ids(self) -> np.ndarray:
+        return np.union1d(self._s, self._o)
+
+    def triples(self, triple_pattern, context=None):
+        ids = [None if term is None else self._encode(term) for term in triple_pattern]
+
+        # A bound term that is not in the snapshot cannot match any triple
+        if any(term is not None and term_id is None for term, term_id in zip(triple_pattern, ids)):
+            return
+
+        for row in self._match_rows(*ids):
+            yield (self._decode(self._s[row]), self._decode(self._p[row]), self._decode(self._o[row])), iter(())
+
+    def __len__(self, context=None):
+        return len(self._s)
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def add(self, triple, context, quoted=False):
+        raise TypeError('A compiled KG snapshot is read-only')
+
+    def remove(self, triple, context=None):
+        raise TypeError('A compiled KG snapshot is read-only')
+
+    def bind(self, prefix, namespace, override=True):
+        if override or prefix not in self._namespaces:
+            self._namespaces[prefix] = namespace
+            self._prefixes[namespace] = prefix
+
+    def namespace(self, prefix):
+        return self._namespaces.get(prefix)
+
+    def prefix(self, namespace):
+        return self._prefixes.get(namespace)
+
+    def namespaces(self):
+        for prefix, namespace in self._namespaces.items():
+            yield prefix, namespace
+
+
+class CompiledGraph(rdflib.Graph):
+    """
+    rdflib Graph over a CompiledStore. Overrides the methods that would otherwise decode every triple of the KG
+    """
+    def __init__(self, snapshot_dir: str):
+        super().__init__(store=CompiledStore(snapshot_dir))
+
+    def all_nodes(self) -> set:
+        return {self.store._decode(term_id) for term_id in self.store.all_node_ids()}
+
+
+def load_compiled_kg_graph(snapshot_dir: str) -> rdflib.Graph:
+    return CompiledGraph(snapshot_dir)
+
+
+if __name__ == '__main__':
+    # One-time compilation of a KG file, run from the ./code directory:
+    #   python -m knowledge_graphs.CompiledGraph ../setup_data/wikidata_kg/14_graph.nt ../setup_data/wikidata_kg/14_graph_compiled
+    from knowledge_graphs.BasicKG import parse_kg_graph
+
+    compile_kg_graph(parse_kg_graph(sys.argv[1]), sys.argv[2])
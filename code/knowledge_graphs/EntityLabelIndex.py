@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import hashlib
+from typing import Optional
+
+import numpy as np
+
+
+def normalize_label(label: str) -> str:
+    """
+    Lowercase, drop punctuation and sort the tokens of a label (same preprocessing as fuzz.token_sort_ratio)
+    """
+    return ' '.join(sorted(re.sub(r'[\W_]+', ' ', label.lower()).split()))
+
+
+def _label_trigrams(label: str) -> set:
+    padded = f' {normalize_label(label)} '
+    return {padded[i: i + 3] for i in range(len(padded) - 2)}
+
+
+def labels_hash(entity_labels_dict: dict) -> str:
+    # Hash of the whole labels dict, so a stored index is rebuilt whenever any label changes
+    return hashlib.sha1(json.dumps(list(entity_labels_dict.items())).encode('utf-8')).hexdigest()
+
+
+class EntityLabelIndex:
+    """
+    Character trigram inverted index over the labels of the entities of a KG.
+
+    It is used to narrow a fuzzy label query down to a small set of candidate entities before scoring them with
+    the edit distance. The posting lists are stored in CSR form: the entries of the trigram `grams[i]` are
+    `postings[offsets[i]: offsets[i + 1]]`, which are positions in `ent_ids`. `gram_counts` has the number of
+    trigrams of each label, and `labels_hash` the hash of the labels dict the index was built from.
+    """
+    def __init__(self, ent_ids: np.ndarray, grams: np.ndarray, offsets: np.ndarray, postings: np.ndarray,
+                 gram_counts: np.ndarray, labels_hash: str = ''):
+        self.ent_ids = ent_ids
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.gram_counts = gram_counts
+        self.labels_hash = str(labels_hash)
+        self._gram2idx = {gram: i for i, gram in enumerate(grams.tolist())}
+
+    def __len__(self):
+        return len(self.ent_ids)
+
+    @classmethod
+    def build(cls, entity_labels_dict: dict) -> 'EntityLabelIndex':
+        gram_postings = {}
+        gram_counts = np.zeros(len(entity_labels_dict), dtype=np.int32)
+        for label_idx, label in enumerate(entity_labels_dict.values()):
+            label_grams = _label_trigrams(label)
+            gram_counts[label_idx] = len(label_grams)
+            for gram in label_grams:
+                gram_postings.setdefault(gram, []).append(label_idx)
+
+        grams = sorted(gram_postings.keys())
+        lengths = np.array([len(gram_postings[gram]) for gram in grams], dtype=np.int64)
+        offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        postings = np.fromiter((label_idx for gram in grams for label_idx in gram_postings[gram]),
+                               dtype=np.int32, count=int(offsets[-1]))
+
+        return cls(
+            ent_ids=np.array(list(entity_labels_dict.keys())),
+            grams=np.array(grams),
+            offsets=offsets,
+            postings=postings,
+            gram_counts=gram_counts,
+            labels_hash=labels_hash(entity_labels_dict)
+        )
+
+    @classmethod
+    def load(cls, filepath: str) -> 'EntityLabelIndex':
+        with np.load(filepath, allow_pickle=False) as index_arrays:
+            return cls(**{name: index_arrays[name] for name in index_arrays.files})
+
+    @classmethod
+    def load_or_build(cls, filepath: Optional[str], entity_labels_dict: dict) -> 'EntityLabelIndex':
+        """
+        Load the index from `filepath` if it exists and matches the labels dict, otherwise build it and store it
+        """
+        if filepath and os.path.exists(filepath):
+            try:
+                index = cls.load(filepath)
+                if index.labels_hash == labels_hash(entity_labels_dict):
+                    return index
+            except TypeError:
+                # Stored by an older version of the index, without all the arrays
+                pass
+
+        index = cls.build(entity_labels_dict)
+        if filepath:
+            index.save(filepath)
+
+        return index
+
+    def save(self, filepath: str) -> None:
+        np.savez(filepath, ent_ids=self.ent_ids, grams=self.grams, offsets=self.offsets, postings=self.postings,
+                 gram_counts=self.gram_counts, labels_hash=np.array(self.labels_hash))
+
+    def candidates(self, query: str, min_overlap: float = 0.3, max_candidates: int = 500,
+                   mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return the positions (in `ent_ids`, ascending) of the labels that share at least a `min_overlap` fraction
+        of the trigrams of the query. If there are more than `max_candidates`, the ones with the largest Dice
+        coefficient of the trigram sets are kept (ties broken by position), and the labels equal to the query
+        after normalization are always kept. `mask` is an optional boolean array over `ent_ids` of the entities
+        that may be returned.
+        """
+        query_grams = _label_trigrams(query)
+        gram_idxs = [self._gram2idx[gram] for gram in query_grams if gram in self._gram2idx]
+
+        if len(gram_idxs) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        hits = np.concatenate([self.postings[self.offsets[i]: self.offsets[i + 1]] for i in gram_idxs])
+        overlap = np.bincount(hits, minlength=len(self.ent_ids))
+
+        if mask is not None:
+            overlap[~mask] = 0
+
+        min_shared = max(1, int(np.ceil(min_overlap * len(query_grams))))
+        candidate_idxs = np.nonzero(overlap >= min_shared)[0]
+
+        if len(candidate_idxs) > max_candidates:
+            candidate_overlap = overlap[candidate_idxs]
+            candidate_gram_counts = self.gram_counts[candidate_idxs]
+            dice = 2 * candidate_overlap / (len(query_grams) + candidate_gram_counts)
+            # Same trigram set as the query, i.e. equal labels after normalization
+            exact = (candidate_overlap == len(query_grams)) & (candidate_gram_counts == len(query_grams))
+
+            # Sorted by exact match, Dice coefficient and position (lexsort sorts by the last key first)
+            order = np.lexsort((candidate_idxs, -dice, ~exact))
+            keep = np.zeros(len(candidate_idxs), dtype=bool)
+            keep[order[:max_candidates]] = True
+            keep |= exact
+            candidate_idxs = candidate_idxs[keep]
+
+        return candidate_idxs
@@ -0,0 +1,52 @@
+import time
+import threading
+from typing import Optional
+
+import rdflib
+from rdflib.plugins.sparql import prepareQuery
+
+
+class PreparedQueryRegistry:
+    """
+    Parses and algebrizes each SPARQL query once, the first time it is used, and reuses it afterwards.
+
+    Values are passed with `initBindings` instead of being formatted into the query text, so a bound variable is
+    resolved with the indexes of the store (e.g. a bound subject uses the subject index). To query several values
+    of a variable, run the query once per value.
+    """
+    def __init__(self, queries: dict, init_ns: Optional[dict] = None):
+        self.queries = queries
+        self.init_ns = init_ns or {}
+        self._prepared = {}
+        self._parse_time = {}
+        self._executions = {}
+        # Queries are run from several handler threads
+        self._lock = threading.Lock()
+
+    def _get_prepared_query(self, name: str):
+        with self._lock:
+            if name not in self._prepared:
+                start = time.perf_counter()
+                self._prepared[name] = prepareQuery(self.queries[name], initNs=self.init_ns)
+                self._parse_time[name] = time.perf_counter() - start
+                self._executions[name] = 0
+
+            self._executions[name] += 1
+            return self._prepared[name]
+
+    def query(self, graph: rdflib.Graph, name: str, bindings: Optional[dict] = None):
+        return graph.query(self._get_prepared_query(name), initBindings=bindings or {})
+
+    def stats(self) -> dict:
+        """
+        Number of executions, parse time and parse time saved by reusing each prepared query
+        """
+        with self._lock:
+            return {
+                name: {'executions': self._executions[name], 'parse_time': self._parse_time[name],
+                       'parse_time_saved': self._parse_time[name] * (self._executions[name] - 1)}
+                for name in self._prepared.keys()
+            }
+
+    def total_parse_time_saved(self) -> float:
+        return sum(query_stats['parse_time_saved'] for query_stats in self.stats().values())
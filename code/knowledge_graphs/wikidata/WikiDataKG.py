@@ -1,15 +1,22 @@
 import json
 import os.path
 import random
+from collections import Counter
 from typing import Optional, Tuple
 
 import numpy as np
 from thefuzz import fuzz
 
 from knowledge_graphs.BasicKG import BasicKG
+from knowledge_graphs.EntityLabelIndex import EntityLabelIndex
+from knowledge_graphs.PreparedQueryRegistry import PreparedQueryRegistry
 from knowledge_graphs.wikidata.embeddings.WikDataEmbeddings import WikiDataEmbeddings
 from knowledge_graphs.wikidata import wikidata_queries
 
+# Values of 'instance of' (P31) that make an entity a person or a movie
+person_instance_of_ents = ('Q5',)
+movie_instance_of_ents = ('Q11424', 'Q24862', 'Q506240', 'Q336144',
+                          'Q20650540', 'Q759853', 'Q110900120', 'Q29168811', 'Q17517379')
 
 class WikiDataKG(BasicKG):
     def __init__(self,
@@ -22,9 +29,46 @@ class WikiDataKG(BasicKG):
                  entity_id_mapping: str,
                  relation_emb: str,
                  relation_id_mapping: str,
-                 recomendation_rules_filepath: str
+                 recomendation_rules_filepath: str,
+                 embedding_search_mode: str = 'exact',
+                 ann_index_filepath: Optional[str] = None,
+                 ann_nprobe: int = 16,
+                 mmap_embeddings: bool = False,
+                 embedding_storage_dtype: str = 'float32',
+                 kg_backend: str = 'rdflib',
+                 kg_snapshot_dir: Optional[str] = None
                  ):
-        super().__init__(kg_tuple_file_path, entity_label_filepath, property_label_filepath)
+        super().__init__(kg_tuple_file_path, entity_label_filepath, property_label_filepath,
+                         kg_backend, kg_snapshot_dir)
+
+        # Trigram index to generate candidates for the fuzzy label matching. Stored next to the labels dict
+        self.entity_label_index = EntityLabelIndex.load_or_build(
+            f'{os.path.splitext(entity_label_filepath)[0]}_trigram_index.npz' if entity_label_filepath else None,
+            self.entity_labels_dict
+        )
+
+        # Precompute the ids of the entities of each type, and a mask of them over the label index
+        self._entity_ids_by_type = {
+            'person': self._get_instances_of(person_instance_of_ents),
+            'movie': self._get_instances_of(movie_instance_of_ents)
+        }
+        self._entity_ids_by_type['person or movie'] = \
+            self._entity_ids_by_type['person'] | self._entity_ids_by_type['movie']
+        self._entity_type_label_masks = {
+            ent_type: np.isin(self.entity_label_index.ent_ids,
+                              np.array([str(self.namespaces.WD[wk_ent_id]) for wk_ent_id in wk_ent_ids]))
+            for ent_type, wk_ent_ids in self._entity_ids_by_type.items()
+        }
+
+        # SPARQL queries are parsed once and reused across messages
+        self.prepared_queries = PreparedQueryRegistry(
+            queries={
+                'imdb': wikidata_queries.imdb_query,
+                'one_hop_prop_count': wikidata_queries.one_hop_prop_count_parameterized,
+                'two_hop_prop_count': wikidata_queries.two_hop_prop_count_parameterized
+            },
+            init_ns={'wd': self.namespaces.WD, 'wdt': self.namespaces.WDT, 'rdfs': self.namespaces.RDFS}
+        )
 
         self.imdb2movienet = json.load(open(imdb2movienet_filepath, 'r'))
 
@@ -35,7 +79,12 @@ class WikiDataKG(BasicKG):
             entity_emb_filepath=entity_emb_filepath,
             entity_id_mapping=entity_id_mapping,
             relation_emb=relation_emb,
-            relation_id_mapping=relation_id_mapping
+            relation_id_mapping=relation_id_mapping,
+            search_mode=embedding_search_mode,
+            ann_index_filepath=ann_index_filepath,
+            ann_nprobe=ann_nprobe,
+            mmap=mmap_embeddings,
+            storage_dtype=embedding_storage_dtype
         ) if entity_emb_filepath and entity_id_mapping and relation_emb and relation_id_mapping else None
 
         self.recommendation_rules_dict = json.load(open(recomendation_rules_filepath, 'r'))
@@ -46,29 +95,31 @@ class WikiDataKG(BasicKG):
     def check_if_property_in_kg(self, wk_prop_id: str) -> bool:
         return str(self.namespaces.WDT[wk_prop_id]) in self.property_labels_dict.keys()
 
+    def _get_instances_of(self, instance_of_ents: tuple) -> frozenset:
+        return frozenset(
+            os.path.basename(str(wk_ent))
+            for obj in instance_of_ents
+            for wk_ent in self.kg.subjects(self.namespaces.WDT.P31, self.namespaces.WD[obj])
+        )
+
+    def get_entity_ids_of_type(self, ent_type: str) -> frozenset:
+        return self._entity_ids_by_type[ent_type]
+
     def check_if_entity_is_person(self, wk_ent_id: str) -> bool:
-        relevant_instace_of_ents = ('Q5',)
-        return any([(self.namespaces.WD[wk_ent_id], self.namespaces.WDT.P31, self.namespaces.WD[obj]) in self.kg
-                    for obj in relevant_instace_of_ents])
+        return wk_ent_id in self._entity_ids_by_type['person']
 
     def check_if_entity_is_movie(self, wk_ent_id: str) -> bool:
-        relevant_instace_of_ents = ('Q11424', 'Q24862', 'Q506240', 'Q336144',
-                                    'Q20650540', 'Q759853', 'Q110900120', 'Q29168811', 'Q17517379')
-        return any([(self.namespaces.WD[wk_ent_id], self.namespaces.WDT.P31, self.namespaces.WD[obj]) in self.kg
-                    for obj in relevant_instace_of_ents])
+        return wk_ent_id in self._entity_ids_by_type['movie']
 
     def check_if_entity_movie_or_person(self, wk_ent_id: str) -> bool:
-        relevant_instace_of_ents = ('Q11424', 'Q5', 'Q24862', 'Q506240', 'Q336144',
-                                    'Q20650540', 'Q759853', 'Q110900120', 'Q29168811', 'Q17517379')
-        return any([(self.namespaces.WD[wk_ent_id], self.namespaces.WDT.P31, self.namespaces.WD[obj]) in self.kg
-                    for obj in relevant_instace_of_ents])
+        return wk_ent_id in self._entity_ids_by_type['person or movie']
 
     def get_object_or_objects(self, wk_ent_id: str, wk_prop_id: str) -> list:
         return [obj for obj in self.kg.objects(self.namespaces.WD.wk_ent_id, self.namespaces.WDT.wk_prop_id)]
 
     def get_imdb_id(self, wk_ent_id: str) -> Optional[str]:
         if self.check_if_entity_in_kg(wk_ent_id):
-            query_result = self.kg.query(wikidata_queries.imdb_query, initBindings={"id": self.namespaces.WD[wk_ent_id]})
+            query_result = self.prepared_queries.query(self.kg, 'imdb', {'id': self.namespaces.WD[wk_ent_id]})
             imdb_ids = [str(imdb[0]) for imdb in query_result]
 
             if len(imdb_ids) >= 1:
@@ -92,24 +143,18 @@ class WikiDataKG(BasicKG):
             -> Optional[str]:
         wk_ent_id = None
         entity_string_to_match = entity_string_to_match.lower().strip('?')
-        filter_fn = lambda x: True
 
-        # Choose the type of filter to use
-        if ent_type == 'person':
-            filter_fn = self.check_if_entity_is_person
+        # Only score with the edit distance the labels of entities of the given type ('person', 'movie' or
+        #  'person or movie') that share enough trigrams with the string to match
+        candidate_ent_ids = self.entity_label_index.ent_ids[self.entity_label_index.candidates(
+            entity_string_to_match, mask=self._entity_type_label_masks.get(ent_type))]
 
-        elif ent_type == 'movie':
-            filter_fn = self.check_if_entity_is_movie
-
-        elif ent_type == 'person or movie':
-            filter_fn = self.check_if_entity_movie_or_person
+        scored_candidates = [(wk_id, fuzz.token_sort_ratio(entity_string_to_match, self.entity_labels_dict[wk_id]))
+                             for wk_id in candidate_ent_ids.tolist()]
 
         # Try matching the entity based on the edit distance
         matches = np.array(
-            [(os.path.basename(wk_id), fuzz.token_sort_ratio(entity_string_to_match, label))
-             for wk_id, label in self.entity_labels_dict.items()
-             if fuzz.token_sort_ratio(entity_string_to_match, label) > 75 and
-             filter_fn(os.path.basename(wk_id))]
+            [(os.path.basename(wk_id), score) for wk_id, score in scored_candidates if score > 75]
         )
 
         if matches.shape[0] > 0:
@@ -154,6 +199,7 @@ class WikiDataKG(BasicKG):
             top_k: int = 10,
             num_criteria_to_report: int = 3,
             num_movies_to_report: int = 4,
+            use_sparql: bool = False
     ) -> Tuple[dict, list]:
 
         # Get the list of the closest_movies
@@ -163,19 +209,28 @@ class WikiDataKG(BasicKG):
             return {}, []
 
         # Check for common property values accross all the closest movies
-        one_hop_recs = self._evaluate_recomendation_rule(
-            closest_ents,
-            rec_rules=self.recommendation_rules_dict['one-hop'],
-            query=wikidata_queries.one_hop_prop_count,
-            top_k=top_k
-        )
+        if use_sparql:
+            one_hop_recs = self._evaluate_recomendation_rule(
+                closest_ents,
+                rec_rules=self.recommendation_rules_dict['one-hop'],
+                query_name='one_hop_prop_count',
+                top_k=top_k
+            )
 
-        two_hop_recs = self._evaluate_recomendation_rule(
-            closest_ents,
-            rec_rules=self.recommendation_rules_dict['two-hop'],
-            query=wikidata_queries.two_hop_prop_count,
-            top_k=top_k
-        )
+            two_hop_recs = self._evaluate_recomendation_rule(
+                closest_ents,
+                rec_rules=self.recommendation_rules_dict['two-hop'],
+                query_name='two_hop_prop_count',
+                top_k=top_k
+            )
+
+        else:
+            one_hop_recs, two_hop_recs = self._evaluate_recomendation_rules_natively(
+                closest_ents,
+                one_hop_rec_rules=self.recommendation_rules_dict['one-hop'],
+                two_hop_rec_rules=self.recommendation_rules_dict['two-hop'],
+                top_k=top_k
+            )
 
         # Remove criteria that might be redundant
         if 'instance of' in one_hop_recs.keys() and 'genre' in one_hop_recs.keys():
@@ -217,26 +272,77 @@ class WikiDataKG(BasicKG):
 
         return recs, closest_movies_str_list
 
-    def _evaluate_recomendation_rule(self, closest_ents, rec_rules: dict, query: str, top_k: int):
+    def _evaluate_recomendation_rule(self, closest_ents, rec_rules: dict, query_name: str, top_k: int):
         criteria_to_recommend = {}
         for wk_prop_id, rule_params in rec_rules.items():
-            common_prop = self.kg.query(
-                query.format(
-                    property_id=wk_prop_id,
-                    wk_ent_list=', '.join([f'wd:{wk_ent_id}' for wk_ent_id in closest_ents]))
-            )
+            # The query is run with each entity bound, so the subject index is used, and the counts are summed
+            prop_counts = Counter()
+            for wk_ent_id in dict.fromkeys(closest_ents):
+                for triple in self.prepared_queries.query(
+                        self.kg, query_name,
+                        {'property': self.namespaces.WDT[wk_prop_id], 'id': self.namespaces.WD[wk_ent_id]}):
+                    prop_counts[(triple[0], str(triple[1]))] += int(triple[2])
 
             # Only add to the list entities of each property that are over the threshold
             #   and exclude labels in rule_params['exclude']
-            tuples_meet_rule = [str(triple[1]) for triple in common_prop
-                                if int(triple[2]) / top_k > rule_params['threshold'] and
-                                str(triple[1]) not in rule_params['exclude']]
+            tuples_meet_rule = [prop_label for (_, prop_label), prop_count in prop_counts.most_common()
+                                if prop_count / top_k > rule_params['threshold'] and
+                                prop_label not in rule_params['exclude']]
 
             if len(tuples_meet_rule) > 0:
                 criteria_to_recommend[rule_params['label']] = tuples_meet_rule
 
         return criteria_to_recommend
 
+    def _get_english_labels(self, node) -> list:
+        return [label for label in self.kg.objects(node, self.namespaces.RDFS.label)
+                if getattr(label, 'language', None) == 'en']
+
+    def _evaluate_recomendation_rules_natively(self, closest_ents, one_hop_rec_rules: dict, two_hop_rec_rules: dict,
+                                               top_k: int) -> Tuple[dict, dict]:
+        """
+        Same criteria as `_evaluate_recomendation_rule` with the one_hop_prop_count and two_hop_prop_count queries,
+        but counting the property values of all the rules in a single pass over the triples of the closest entities
+        """
+        # Count the (value, english label) pairs of each rule property, as grouped by the SPARQL queries
+        one_hop_counts = {wk_prop_id: Counter() for wk_prop_id in one_hop_rec_rules.keys()}
+        two_hop_counts = {wk_prop_id: Counter() for wk_prop_id in two_hop_rec_rules.keys()}
+        rule_props = {self.namespaces.WDT[wk_prop_id]: wk_prop_id
+                      for wk_prop_id in one_hop_rec_rules.keys() | two_hop_rec_rules.keys()}
+
+        for wk_ent_id in dict.fromkeys(closest_ents):
+            for prop, prop_value in self.kg.predicate_objects(self.namespaces.WD[wk_ent_id]):
+                wk_prop_id = rule_props.get(prop)
+                if wk_prop_id is None:
+                    continue
+
+                if wk_prop_id in one_hop_counts:
+                    one_hop_counts[wk_prop_id].update(
+                        (prop_value, label) for label in self._get_english_labels(prop_value))
+
+                if wk_prop_id in two_hop_counts:
+                    two_hop_counts[wk_prop_id].update(
+                        (prop_inst, label)
+                        for prop_inst in self.kg.objects(prop_value, self.namespaces.WDT.P31)
+                        for label in self._get_english_labels(prop_inst))
+
+        recs = []
+        for rec_rules, prop_counts in ((one_hop_rec_rules, one_hop_counts), (two_hop_rec_rules, two_hop_counts)):
+            criteria_to_recommend = {}
+            for wk_prop_id, rule_params in rec_rules.items():
+                # Only add to the list entities of each property that are over the threshold
+                #   and exclude labels in rule_params['exclude']
+                tuples_meet_rule = [str(label) for (_, label), count in prop_counts[wk_prop_id].most_common()
+                                    if count / top_k > rule_params['threshold'] and
+                                    str(label) not in rule_params['exclude']]
+
+                if len(tuples_meet_rule) > 0:
+                    criteria_to_recommend[rule_params['label']] = tuples_meet_rule
+
+            recs.append(criteria_to_recommend)
+
+        return recs[0], recs[1]
+
 
 if __name__ == '__main__':
     kg = WikiDataKG(
@@ -258,6 +364,17 @@ if __name__ == '__main__':
 
     assert kg.get_wkdata_entid_based_on_label_match('Martin Scorsese') == 'Q41148'
     print(kg.recommend_similar_movies_and_characateristics(['Q179673', 'Q36479', 'Q218894']))
+
+    # The native counting of the recommendation criteria gives the same result as the SPARQL queries
+    closest_ents_ = kg.kg_embeddings.get_most_similar_entities_to_centroid(['Q179673', 'Q36479', 'Q218894'])
+    for hops_, query_ in (('one-hop', 'one_hop_prop_count'), ('two-hop', 'two_hop_prop_count')):
+        native_recs = kg._evaluate_recomendation_rules_natively(
+            closest_ents_, kg.recommendation_rules_dict['one-hop'], kg.recommendation_rules_dict['two-hop'], 10)
+        sparql_recs = kg._evaluate_recomendation_rule(
+            closest_ents_, kg.recommendation_rules_dict[hops_], query_, 10)
+        assert {k: set(v) for k, v in native_recs[0 if hops_ == 'one-hop' else 1].items()} == \
+               {k: set(v) for k, v in sparql_recs.items()}
+    print(f'Parse time saved by the prepared queries: {kg.prepared_queries.total_parse_time_saved():0.3f}s')
     assert kg.get_wkdata_entid_based_on_label_match('Martin Scorsese', ent_type='person') == 'Q41148'
     assert kg.get_wkdata_entid_based_on_label_match('Martin Scorssese') == 'Q41148'
 
@@ -0,0 +1,114 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def _squared_distances(queries: np.ndarray, vectors: np.ndarray, vectors_sq_norms: np.ndarray) -> np.ndarray:
+    # ||q - v||^2 = ||q||^2 - 2 q.v + ||v||^2
+    return (queries ** 2).sum(axis=1, keepdims=True) - 2 * queries @ vectors.T + vectors_sq_norms
+
+
+def _assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    centroids_sq_norms = (centroids ** 2).sum(axis=1)
+    return np.concatenate([
+        _squared_distances(vectors[i: i + chunk_size].astype(np.float32), centroids, centroids_sq_norms).argmin(axis=1)
+        for i in range(0, len(vectors), chunk_size)
+    ])
+
+
+class IVFIndex:
+    """
+    Inverted file index for approximate nearest neighbour search with the euclidean distance.
+
+    The vectors are clustered with k-means and each one is stored in the list of its closest centroid. A query only
+    computes exact distances to the vectors in the lists of its `nprobe` closest centroids. The lists are stored in
+    CSR form: the vectors of list i are `list_ids[list_offsets[i]: list_offsets[i + 1]]`.
+    """
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray, nprobe: int = 16):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+        self._centroids_sq_norms = (centroids ** 2).sum(axis=1)
+
+    @property
+    def num_vectors(self) -> int:
+        return len(self.list_ids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, num_lists: Optional[int] = None, num_iter: int = 10,
+              train_sample_size: int = 50000, nprobe: int = 16, seed: int = 0) -> 'IVFIndex':
+        rng = np.random.default_rng(seed)
+        num_lists = num_lists or max(1, int(4 * np.sqrt(len(vectors))))
+
+        # Train the k-means centroids on a sample of the vectors
+        train_vectors = np.asarray(
+            vectors[np.sort(rng.choice(len(vectors), min(train_sample_size, len(vectors)), replace=False))],
+            dtype=np.float32)
+        centroids = train_vectors[rng.choice(len(train_vectors), num_lists, replace=False)].copy()
+
+        for _ in range(num_iter):
+            assignment = _assign_to_centroids(train_vectors, centroids)
+            counts = np.bincount(assignment, minlength=num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, train_vectors)
+            # Empty clusters keep their previous centroid
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+        # Put every vector in the list of its closest centroid
+        assignment = _assign_to_centroids(vectors, centroids)
+        list_ids = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=num_lists), out=list_offsets[1:])
+
+        return cls(centroids, list_offsets, list_ids, nprobe)
+
+    @classmethod
+    def load(cls, filepath: str, nprobe: int = 16) -> 'IVFIndex':
+        with np.load(filepath, allow_pickle=False) as index_arrays:
+            return cls(index_arrays['centroids'], index_arrays['list_offsets'], index_arrays['list_ids'], nprobe)
+
+    @classmethod
+    def load_or_build(cls, filepath: Optional[str], vectors: np.ndarray, nprobe: int = 16) -> 'IVFIndex':
+        if filepath and os.path.exists(filepath):
+            index = cls.load(filepath, nprobe)
+            if index.num_vectors == len(vectors):
+                return index
+
+        index = cls.build(vectors, nprobe=nprobe)
+        if filepath:
+            index.save(filepath)
+
+        return index
+
+    def save(self, filepath: str) -> None:
+        np.savez(filepath, centroids=self.centroids, list_offsets=self.list_offsets, list_ids=self.list_ids)
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, top_k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the distances and positions in `vectors` (the indexed array) of the approximate `top_k` closest
+        vectors to `query`, sorted by distance
+        """
+        query = query.reshape(1, -1).astype(np.float32)
+
+        # Candidates are the vectors in the lists of the closest centroids
+        closest_lists = np.argsort(
+            _squared_distances(query, self.centroids, self._centroids_sq_norms)[0])[:self.nprobe]
+        candidate_ids = np.concatenate(
+            [self.list_ids[self.list_offsets[i]: self.list_offsets[i + 1]] for i in closest_lists])
+
+        # The probed lists can all be empty (e.g. clusters left empty by k-means)
+        top_k = min(top_k, len(candidate_ids))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.float32), candidate_ids[:0]
+
+        candidate_vectors = np.asarray(vectors[candidate_ids], dtype=np.float32)
+
+        dist = np.sqrt(np.maximum(
+            _squared_distances(query, candidate_vectors, (candidate_vectors ** 2).sum(axis=1))[0], 0))
+        top = np.argpartition(dist, top_k - 1)[:top_k]
+        top = top[np.argsort(dist[top])]
+
+        return dist[top], candidate_ids[top]
@@ -1,12 +1,15 @@
 import os
 import csv
-from typing import Tuple, Optional
+import time
+from typing import Tuple, Optional, List
 
 import rdflib
 import numpy as np
 from sklearn.metrics import pairwise_distances
 
 from knowledge_graphs.BasicKG import Namespaces
+from knowledge_graphs.wikidata.embeddings.IVFIndex import IVFIndex
+from utils.utils import get_rss_mb
 
 
 def _load_id_mappers(id_mapping_filepath: str):
@@ -17,33 +20,86 @@ def _load_id_mappers(id_mapping_filepath: str):
         return wk_id2emb_id, emb_id2wk_id
 
 
+def _load_embeddings(emb_filepath: str, mmap: bool = False, storage_dtype: str = 'float32') -> np.ndarray:
+    # float16 embeddings are stored in a copy of the file next to the original one, created the first time
+    if storage_dtype == 'float16':
+        float16_emb_filepath = f'{os.path.splitext(emb_filepath)[0]}_float16.npy'
+        if not os.path.exists(float16_emb_filepath):
+            np.save(float16_emb_filepath, np.load(emb_filepath, mmap_mode='r').astype(np.float16))
+        emb_filepath = float16_emb_filepath
+
+    elif storage_dtype != 'float32':
+        raise ValueError(f'Unsupported embedding storage dtype: {storage_dtype}')
+
+    # With mmap the OS page cache holds the embeddings, which is shared by all the processes that open the file
+    return np.load(emb_filepath, mmap_mode='r' if mmap else None)
+
+
 class WikiDataEmbeddings:
     def __init__(self, entity_emb_filepath: str, entity_id_mapping: str,
-                 relation_emb: str, relation_id_mapping: str):
+                 relation_emb: str, relation_id_mapping: str,
+                 search_mode: str = 'exact', ann_index_filepath: Optional[str] = None, ann_nprobe: int = 16,
+                 mmap: bool = False, storage_dtype: str = 'float32'):
         self.namespaces = Namespaces()
 
-        # load the embeddings
-        self.entity_emb = np.load(entity_emb_filepath)
-        self.relation_emb = np.load(relation_emb)
+        # load the embeddings. Computations are always done in float32, even if they are stored in float16
+        self.entity_emb = _load_embeddings(entity_emb_filepath, mmap, storage_dtype)
+        self.relation_emb = _load_embeddings(relation_emb, mmap, storage_dtype)
 
         # load dictinoaries to mapa wikidata entity and property id to the embeddings id or index in the array
         self.ent2id, self.id2ent = _load_id_mappers(entity_id_mapping)
         self.rel2id, self.id2rel = _load_id_mappers(relation_id_mapping)
 
+        # Wikidata id of each row for the exact search. The squared norms of the rows are computed on the first search
+        self._entity_sq_norms = None
+        self._entity_wk_ids = np.array([os.path.basename(str(self.id2ent.get(emb_id, '')))
+                                        for emb_id in range(len(self.entity_emb))])
+
+        # Search the closest entities exactly ('exact') or with an approximate nearest neighbour index ('ann')
+        if search_mode not in ('exact', 'ann'):
+            raise ValueError(f'Unknown embedding search mode: {search_mode}')
+        self.search_mode = search_mode
+        self.ann_index = IVFIndex.load_or_build(ann_index_filepath, self.entity_emb, nprobe=ann_nprobe) \
+            if search_mode == 'ann' else None
+
     def deduce_object(self, wk_ent_id: str, wk_prop_id: str,
                       top_k: int = 10, ptg_max_diff_top_k: float = 0.2, report_max: int = 4) -> \
             Optional[Tuple[str, ...]]:
-
-        # Retrieve the embeddings of the corresponding elements
-        if self.namespaces.WD[wk_ent_id] in self.ent2id.keys() and \
-                self.namespaces.WDT[wk_prop_id] in self.rel2id.keys():
-            subj_emb = self.entity_emb[self.ent2id[self.namespaces.WD[wk_ent_id]]]
-            pred_emb = self.relation_emb[self.rel2id[self.namespaces.WDT[wk_prop_id]]]
-
-            # Add vectors according to TransE scoring function.
-            pred_obj_emb = subj_emb + pred_emb
-
-            dist_top_k, top_k_emb_ids = self._return_most_similar_entites(embedding=pred_obj_emb, top_k=top_k)
+        return self.deduce_object_batch([(wk_ent_id, wk_prop_id)], top_k, ptg_max_diff_top_k, report_max)[0]
+
+    def deduce_object_batch(self, wk_ent_prop_id_pairs: list,
+                            top_k: int = 10, ptg_max_diff_top_k: float = 0.2, report_max: int = 4) -> \
+            List[Optional[Tuple[str, ...]]]:
+        """
+        deduce_object for a list of (wk_ent_id, wk_prop_id) pairs, searching the closest entities of all of them
+        with a single matrix-matrix product
+        """
+        # Retrieve the embeddings of the corresponding elements, for the pairs for which we have them
+        answerable = [self.namespaces.WD[wk_ent_id] in self.ent2id.keys() and
+                      self.namespaces.WDT[wk_prop_id] in self.rel2id.keys()
+                      for wk_ent_id, wk_prop_id in wk_ent_prop_id_pairs]
+
+        # Add vectors according to TransE scoring function.
+        pred_obj_embs = [
+            self.entity_emb[self.ent2id[self.namespaces.WD[wk_ent_id]]].astype(np.float32) +
+            self.relation_emb[self.rel2id[self.namespaces.WDT[wk_prop_id]]].astype(np.float32)
+            for (wk_ent_id, wk_prop_id), answerable_i in zip(wk_ent_prop_id_pairs, answerable) if answerable_i
+        ]
+
+        closest_entities = iter(self._return_most_similar_entites_batch(np.array(pred_obj_embs), top_k=top_k)) \
+            if len(pred_obj_embs) > 0 else iter(())
+
+        objects = []
+        for answerable_i in answerable:
+            if not answerable_i:
+                objects.append(None)
+                continue
+
+            dist_top_k, top_k_emb_ids = next(closest_entities)
+            if len(dist_top_k) == 0:
+                # The ANN index found no candidates
+                objects.append(None)
+                continue
 
             # Calculate difference in distance between 1 and 10th option.
             # All those below 10% of that distance are included as the answer
@@ -51,42 +107,144 @@ class WikiDataEmbeddings:
             plausible_objects = dist_top_k - dist_top_k[0] < ptg_max_diff_top_k * large_dist
 
             object_emb_id_to_report = top_k_emb_ids[plausible_objects]
-            object_emb_id_to_report = tuple(object_emb_id_to_report[:min(len(object_emb_id_to_report), report_max)])
+            objects.append(tuple(object_emb_id_to_report[:min(len(object_emb_id_to_report), report_max)]))
 
-            return object_emb_id_to_report
-
-        else:
-            return None
+        return objects
 
     def get_most_similar_entities_to_centroid(self, wk_ent_id_list: list, top_k: int = 10) -> Optional[np.ndarray]:
-        closest_entities = None
-
-        # Get embedding for centroid
-        centroid = self._calculate_centroid(wk_ent_id_list)
+        return self.get_most_similar_entities_to_centroid_batch([wk_ent_id_list], top_k)[0]
+
+    def get_most_similar_entities_to_centroid_batch(self, wk_ent_id_lists: list, top_k: int = 10) -> list:
+        """
+        get_most_similar_entities_to_centroid for a list of entity lists, with a single matrix-matrix product
+        """
+        # Get embedding for centroids
+        centroids = [self._calculate_centroid(wk_ent_id_list) for wk_ent_id_list in wk_ent_id_lists]
+        centroids_to_search = [centroid for centroid in centroids if centroid is not None]
+
+        if len(centroids_to_search) == 0:
+            return [None] * len(wk_ent_id_lists)
+
+        # Get the entities most similar to the centroids
+        closest_entities_batch = iter(self._return_most_similar_entites_batch(
+            np.array(centroids_to_search),
+            top_k=top_k + max(len(wk_ent_id_list) for wk_ent_id_list in wk_ent_id_lists)
+        ))
+
+        closest_entities_list = []
+        for centroid, wk_ent_id_list in zip(centroids, wk_ent_id_lists):
+            closest_entities = None
+
+            if centroid is not None:
+                _, closest_entities = next(closest_entities_batch)
+
+                # Remove the entities that compose the cnentroid
+                closest_entities = [entity for entity in closest_entities if entity not in wk_ent_id_list]
+                closest_entities = closest_entities[: top_k]
+
+            closest_entities_list.append(closest_entities)
+
+        return closest_entities_list
+
+    def _entity_emb_chunks(self, chunk_size: int = 65536):
+        # Rows of entity_emb in float32. float16 storage is converted one chunk at a time, so neither a float32 copy
+        #  of the whole matrix is kept in memory nor the memory-mapped pages are duplicated
+        for start in range(0, len(self.entity_emb), chunk_size):
+            yield np.asarray(self.entity_emb[start: start + chunk_size], dtype=np.float32)
+
+    def _entity_emb_dot(self, embeddings: np.ndarray) -> np.ndarray:
+        # entity_emb @ embeddings, for a (dim, num_queries) matrix. Batching the queries amortizes the conversion
+        if self.entity_emb.dtype == np.float32:
+            return self.entity_emb @ embeddings
+
+        return np.concatenate([chunk @ embeddings for chunk in self._entity_emb_chunks()])
+
+    def _get_entity_sq_norms(self) -> np.ndarray:
+        if self._entity_sq_norms is None:
+            self._entity_sq_norms = np.concatenate(
+                [np.einsum('ij,ij->i', chunk, chunk) for chunk in self._entity_emb_chunks()])
+
+        return self._entity_sq_norms
+
+    def _return_most_similar_entites(self, embedding: np.ndarray, top_k: int = 10,
+                                     search_mode: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if (search_mode or self.search_mode) == 'ann':
+            dist_top_k_entities, top_k_emb_ids = self.ann_index.search(self.entity_emb, embedding, top_k)
+            return dist_top_k_entities, self._entity_wk_ids[top_k_emb_ids]
+
+        return self._return_most_similar_entites_batch(embedding.reshape(1, -1), top_k, search_mode='exact')[0]
+
+    def _return_most_similar_entites_batch(self, embeddings: np.ndarray, top_k: int = 10,
+                                           search_mode: Optional[str] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Distances and wikidata ids of the top_k closest entities to each row of `embeddings`
+        """
+        if (search_mode or self.search_mode) == 'ann':
+            return [self._return_most_similar_entites(embedding, top_k, search_mode='ann') for embedding in embeddings]
+
+        # Compute the squared distance to *any* entity: ||e||^2 - 2 e.x + ||x||^2, with a single matrix product
+        embeddings = embeddings.astype(np.float32)
+        sq_dist = self._get_entity_sq_norms()[None, :] - 2 * self._entity_emb_dot(embeddings.T).T + \
+            np.einsum('ij,ij->i', embeddings, embeddings)[:, None]
+
+        # Find the top_k most plausible entities of each query, and only sort those
+        top_k = min(top_k, sq_dist.shape[1])
+        most_likely = np.argpartition(sq_dist, top_k - 1, axis=1)[:, :top_k]
+        most_likely = np.take_along_axis(
+            most_likely, np.argsort(np.take_along_axis(sq_dist, most_likely, axis=1), axis=1), axis=1)
 
-        if centroid is not None:
-            # Get the entities most similar to the centroid
-            _, closest_entities = self._return_most_similar_entites(centroid, top_k=top_k + len(wk_ent_id_list))
-
-            # Remove the entities that compose the cnentroid
-            closest_entities = [entity for entity in closest_entities if entity not in wk_ent_id_list]
-            closest_entities = closest_entities[: top_k]
-
-        return closest_entities
+        # Return the top_k closest entities
+        dist_top_k_entities = np.sqrt(np.maximum(np.take_along_axis(sq_dist, most_likely, axis=1), 0))
+        return [(dist_top_k_entities[i], self._entity_wk_ids[most_likely[i]]) for i in range(len(embeddings))]
 
-    def _return_most_similar_entites(self, embedding: np.ndarray, top_k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
-        # Compute distance to *any* entity
+    def _return_most_similar_entites_pairwise(self, embedding: np.ndarray,
+                                              top_k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        # Original exact search, with a full sort of the distances. Kept as a reference for benchmark_exact_search
         dist = pairwise_distances(embedding.reshape(1, -1), self.entity_emb).reshape(-1)
-
-        # Find most plausible entities
         most_likely = dist.argsort()
 
-        # Return the top_k closest entities
         dist_top_k_entities = dist[most_likely[0: top_k]]
         id_top_k_closest_entities = np.array(
             [os.path.basename(str(self.id2ent[object_emb_id])) for object_emb_id in most_likely[0: top_k]])
         return dist_top_k_entities, id_top_k_closest_entities
 
+    def benchmark_exact_search(self, num_queries: int = 100, top_k: int = 10, seed: int = 0) -> dict:
+        """
+        Time the exact search against the original pairwise_distances + argsort implementation, and count the
+        queries for which both return the same top_k entities in the same order
+        """
+        rng = np.random.default_rng(seed)
+        queries = [self.entity_emb[ent_emb_id].astype(np.float32) + self.relation_emb[rel_emb_id].astype(np.float32)
+                   for ent_emb_id, rel_emb_id in zip(rng.choice(len(self.entity_emb), num_queries),
+                                                     rng.choice(len(self.relation_emb), num_queries))]
+
+        results = {}
+        for name, search_fn in (('pairwise', self._return_most_similar_entites_pairwise),
+                                ('exact', lambda query, k: self._return_most_similar_entites(query, k, 'exact'))):
+            start = time.perf_counter()
+            results[name] = [search_fn(query, top_k)[1] for query in queries]
+            results[f'{name}_ms_per_query'] = 1000 * (time.perf_counter() - start) / num_queries
+
+        results['identical'] = sum(np.array_equal(pairwise_ids, exact_ids)
+                                   for pairwise_ids, exact_ids in zip(results.pop('pairwise'), results.pop('exact')))
+        return results
+
+    def evaluate_ann_recall(self, num_queries: int = 100, top_k: int = 10, seed: int = 0) -> float:
+        """
+        Fraction of the exact top_k closest entities that the ANN index also returns, averaged over queries built
+        like the ones of deduce_object (a random entity plus a random relation)
+        """
+        rng = np.random.default_rng(seed)
+        recalls = []
+        for ent_emb_id, rel_emb_id in zip(rng.choice(len(self.entity_emb), num_queries),
+                                          rng.choice(len(self.relation_emb), num_queries)):
+            query = self.entity_emb[ent_emb_id].astype(np.float32) + self.relation_emb[rel_emb_id].astype(np.float32)
+            _, exact_ids = self._return_most_similar_entites(query, top_k, search_mode='exact')
+            _, ann_ids = self._return_most_similar_entites(query, top_k, search_mode='ann')
+            recalls.append(len(set(exact_ids) & set(ann_ids)) / top_k)
+
+        return float(np.mean(recalls))
+
     def _calculate_centroid(self, wk_ent_id_list: list) -> Optional[np.ndarray]:
         centroid_emb = None
         # Filter out entities for which we do not have an embedding
@@ -94,25 +252,53 @@ class WikiDataEmbeddings:
                           self.namespaces.WD[wk_ent_id] in self.ent2id.keys()]
 
         if len(wk_ent_id_list) > 0:
-            for i, wk_ent_id_i in enumerate(wk_ent_id_list):
-                if i == 0:
-                    centroid_emb = self.entity_emb[self.ent2id[self.namespaces.WD[wk_ent_id_i]]]
-                else:
-                    centroid_emb += self.entity_emb[self.ent2id[self.namespaces.WD[wk_ent_id_i]]]
+            # Sum into a new array, not into a row of entity_emb (it must stay unchanged for the precomputed norms)
+            centroid_emb = np.zeros(self.entity_emb.shape[1], dtype=np.float32)
+            for wk_ent_id_i in wk_ent_id_list:
+                centroid_emb += self.entity_emb[self.ent2id[self.namespaces.WD[wk_ent_id_i]]]
 
             return centroid_emb/len(wk_ent_id_list)
 
         return centroid_emb
 
 
+def measure_loading(**embeddings_kwargs) -> dict:
+    """
+    Startup time and resident memory of loading the embeddings and answering a first query.
+    Call it in a fresh process for each configuration, as the resident memory is the one of the whole process
+    """
+    start = time.perf_counter()
+    wk_emb_ = WikiDataEmbeddings(**embeddings_kwargs)
+    load_time = time.perf_counter() - start
+    wk_emb_.deduce_object(wk_ent_id='Q36479', wk_prop_id='P495')
+
+    return {'load_time': load_time, 'first_query_time': time.perf_counter() - start - load_time,
+            'rss_mb': get_rss_mb()}
+
+
 if __name__ == '__main__':
     # Get the the entity embeddings closest to the lion king
     wk_emb = WikiDataEmbeddings(
         entity_emb_filepath='../../../../setup_data/wikidata_kg/embeddings/entity_embeds.npy',
         entity_id_mapping='../../setup_data/wikidata_kg/embeddings/entity_ids.del',
         relation_emb='../../setup_data/wikidata_kg/embeddings/relation_embeds.npy',
-        relation_id_mapping='../../setup_data/wikidata_kg/embeddings/relation_ids.del'
+        relation_id_mapping='../../setup_data/wikidata_kg/embeddings/relation_ids.del',
+        search_mode='ann',
+        ann_index_filepath='../../../../setup_data/wikidata_kg/embeddings/entity_embeds_ivf.npz'
     )
+    print(f'ANN recall@10: {wk_emb.evaluate_ann_recall():0.3f}')
+    print(wk_emb.benchmark_exact_search())
+
+    # Compare startup time and memory of loading the embeddings in memory, memory-mapped, and memory-mapped float16
+    import multiprocessing
+    for mmap_, storage_dtype_ in ((False, 'float32'), (True, 'float32'), (True, 'float16')):
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            print(f'mmap={mmap_}, storage_dtype={storage_dtype_}:', pool.apply(measure_loading, kwds=dict(
+                entity_emb_filepath='../../../../setup_data/wikidata_kg/embeddings/entity_embeds.npy',
+                entity_id_mapping='../../setup_data/wikidata_kg/embeddings/entity_ids.del',
+                relation_emb='../../setup_data/wikidata_kg/embeddings/relation_embeds.npy',
+                relation_id_mapping='../../setup_data/wikidata_kg/embeddings/relation_ids.del',
+                mmap=mmap_, storage_dtype=storage_dtype_)))
 
     a = wk_emb.deduce_object(wk_ent_id='Q36479', wk_prop_id='P495')
 
@@ -121,4 +307,8 @@ if __name__ == '__main__':
     )
     print(b)
 
+    # Batched queries give the same results as one query at a time
+    assert wk_emb.deduce_object_batch([('Q36479', 'P495'), ('Q179673', 'P57')]) == \
+           [wk_emb.deduce_object('Q36479', 'P495'), wk_emb.deduce_object('Q179673', 'P57')]
+
 
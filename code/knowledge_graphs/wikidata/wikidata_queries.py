@@ -224,3 +224,39 @@ WHERE {{
 GROUP BY ?prop_inst ?prop_inst_label
 ORDER BY DESC(?prop_count) 
 """
+
+
+"""
+###############################
+Parameterized queries for PreparedQueryRegistry
+    ?property and ?id are given as bindings, the queries are run once per ?id
+###############################
+
+"""
+one_hop_prop_count_parameterized = """
+prefix wdt: <http://www.wikidata.org/prop/direct/>
+prefix wd: <http://www.wikidata.org/entity/>
+SELECT DISTINCT ?prop ?prop_label (COUNT(?prop) AS ?prop_count) 
+WHERE {
+    ?id ?property ?prop .
+    ?prop rdfs:label ?prop_label .
+    FILTER(LANG(?prop_label) = "en").
+}
+GROUP BY ?prop ?prop_label
+ORDER BY DESC(?prop_count) 
+"""
+
+
+two_hop_prop_count_parameterized = """
+prefix wdt: <http://www.wikidata.org/prop/direct/>
+prefix wd: <http://www.wikidata.org/entity/>
+SELECT DISTINCT ?prop_inst ?prop_inst_label (COUNT(?prop) AS ?prop_count) 
+WHERE {
+    ?id ?property ?prop .
+    ?prop wdt:P31 ?prop_inst .
+    ?prop_inst rdfs:label ?prop_inst_label . 
+    FILTER(LANG(?prop_inst_label) = "en").
+}
+GROUP BY ?prop_inst ?prop_inst_label
+ORDER BY DESC(?prop_count) 
+"""
@@ -1,24 +1,83 @@
+import re
+from typing import Iterator, Optional
+
+import torch
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 
+from utils.response_cache import ResponseCache
+
+# End of a sentence in the generated text, where a chunk of the stream is yielded, unless the period ends an
+#  abbreviation or an initial (e.g. "Mr." or "J.")
+sentence_end_regex = re.compile(r'[.!?]\s*$')
+abbreviation_end_regex = re.compile(r'\b([A-Z]|Mr|Mrs|Ms|Dr|Prof|St|Jr|Sr|vs|etc|e\.g|i\.e)\.\s*$')
+
 
 class RedirectionAgent:
-    def __init__(self):
-        self.tokenizer = AutoTokenizer.from_pretrained("microsoft/GODEL-v1_1-base-seq2seq")
-        self.model = AutoModelForSeq2SeqLM.from_pretrained("microsoft/GODEL-v1_1-base-seq2seq")
+    def __init__(self, model_name: str = "microsoft/GODEL-v1_1-base-seq2seq", quantize: bool = False,
+                 response_cache: Optional[ResponseCache] = None):
+        # Cache of the small talk responses to repeated messages
+        self.response_cache = response_cache
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+        if quantize:
+            # Dynamic int8 quantization of the linear layers, which dominate the generation time on CPU
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
 
-    def _generate(self, instruction, knowledge, dialog):
+    def _get_input_ids(self, instruction, knowledge, dialog) -> torch.Tensor:
         if knowledge != '':
             knowledge = '[KNOWLEDGE] ' + knowledge
 
         dialog = ' EOS '.join(dialog)
         query = f"{instruction} [CONTEXT] {dialog} {knowledge}"
-        input_ids = self.tokenizer(f"{query}", return_tensors="pt").input_ids
-        outputs = self.model.generate(input_ids, max_length=128, min_length=8, top_p=0.9, do_sample=True)
-        output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        return self.tokenizer(query, return_tensors="pt").input_ids
+
+    def _generate(self, instruction, knowledge, dialog):
+        return ''.join(self._generate_stream(instruction, knowledge, dialog))
 
-        return output
+    def _generate_stream(self, instruction, knowledge, dialog, max_length: int = 128, min_length: int = 8,
+                         top_p: float = 0.9, top_k: int = 50) -> Iterator[str]:
+        """
+        Sample the response token by token (with the same top-k and top-p sampling of model.generate), yielding
+        it in chunks that end at the end of a sentence as soon as they are generated
+        """
+        eos_token_id = self.model.config.eos_token_id
+        output_ids = [self.model.config.decoder_start_token_id]
+        past_key_values = None
+        yielded_text = ''
 
-    def small_talk_and_redirect_conversation(self, message) -> str:
+        with torch.inference_mode():
+            encoder_outputs = self.model.get_encoder()(input_ids=self._get_input_ids(instruction, knowledge, dialog))
+
+            while len(output_ids) < max_length:
+                # Only the last token is fed to the decoder, the previous ones are in the cached keys and values
+                outputs = self.model(encoder_outputs=encoder_outputs, past_key_values=past_key_values,
+                                     decoder_input_ids=torch.tensor([output_ids[-1:]]), use_cache=True)
+                past_key_values = outputs.past_key_values
+                logits = outputs.logits[0, -1, :]
+
+                if len(output_ids) < min_length:
+                    logits[eos_token_id] = -float('inf')
+
+                # Top-k and top-p sampling
+                top_logits, top_ids = logits.topk(top_k)
+                probs = torch.softmax(top_logits, dim=-1)
+                probs[probs.cumsum(dim=-1) - probs > top_p] = 0
+                next_token_id = top_ids[torch.multinomial(probs / probs.sum(), 1)].item()
+
+                if next_token_id == eos_token_id:
+                    break
+
+                output_ids.append(next_token_id)
+                text = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+                if sentence_end_regex.search(text) and not abbreviation_end_regex.search(text):
+                    yield text[len(yielded_text):]
+                    yielded_text = text
+
+        text = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        if len(text) > len(yielded_text):
+            yield text[len(yielded_text):]
+
+    def _get_small_talk_prompt(self, message) -> tuple:
         instruction = f'Instruction: given a dialog context, respond basic questions or small talk ' \
                       f'and always change the conversation to movies or films'
         knowledge = ''
@@ -31,4 +90,25 @@ class RedirectionAgent:
             message
         ]
 
-        return self._generate(instruction, knowledge, dialog)
\ No newline at end of file
+        return instruction, knowledge, dialog
+
+    def small_talk_and_redirect_conversation(self, message) -> str:
+        return ''.join(self.small_talk_and_redirect_conversation_stream(message))
+
+    def small_talk_and_redirect_conversation_stream(self, message) -> Iterator[str]:
+        """
+        Same response as small_talk_and_redirect_conversation, yielded sentence by sentence. A cached response is
+        yielded at once
+        """
+        cached_response = self.response_cache.get(message) if self.response_cache else None
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        response_chunks = []
+        for chunk in self._generate_stream(*self._get_small_talk_prompt(message)):
+            response_chunks.append(chunk)
+            yield chunk
+
+        if self.response_cache:
+            self.response_cache.put(message, ''.join(response_chunks))
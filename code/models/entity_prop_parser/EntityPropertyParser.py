@@ -1,18 +1,31 @@
 import json
 import os
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union, Optional, Callable
 
 import spacy
 import numpy as np
 from spacy.matcher import PhraseMatcher
-from spacy.tokens import Doc
+from spacy.tokens import Doc, Span
 
 from utils.utils import merge_dicts
+# Registers the local_entity_linker pipe
+from models.entity_prop_parser import LocalEntityLinker
 
 spacy_model_types = {'sm': 'en_core_web_sm',  'md': 'en_core_web_md', 'lg': 'en_core_web_lg', 'trf': 'en_core_web_trf'}
 
+# Levels of analysis of a message, from the cheapest to the most expensive:
+#   'tokens': only the tokenizer, enough for the PhraseMatchers
+#   'ner': the named entity recognizer and the components that set the lemmas (not the dependency parser)
+#   'full': the whole pipeline, including the entity linkers
+analysis_levels = ('tokens', 'ner', 'full')
+
 
 def _get_wikidata_entities_from_entity_fishing(preprocessed_doc: Doc) -> dict:
+    # Set by the entityfishing or the local_entity_linker pipes
+    if not Span.has_extension('kb_qid'):
+        return {}
+
     return {
         ent._.kb_qid: {'url': ent._.url_wikidata, 'score': ent._.nerd_score, 'text': ent.text,
                        'ner_type': ent.label_}
@@ -32,23 +45,93 @@ def _get_wikidata_entities_from_entity_linker(preprocessed_doc: Doc) -> dict:
     }
 
 
+class MessageAnalysis:
+    """
+    Analysis of a message shared by all the methods of EntityPropertyParser and the regex matchers. The message is
+    parsed lazily at the level each method needs (see `analysis_levels`), and a doc parsed at a level is reused by
+    the methods that need the same or a lower level
+    """
+    def __init__(self, text: str, parse_fn: Callable[[str, str], Doc]):
+        self.text = text
+        self._parse_fn = parse_fn
+        self._docs = {}
+
+    def get_doc(self, level: str = 'full') -> Doc:
+        for parsed_level in analysis_levels[analysis_levels.index(level):]:
+            if parsed_level in self._docs:
+                return self._docs[parsed_level]
+
+        self._docs[level] = self._parse_fn(self.text, level)
+        return self._docs[level]
+
+    @property
+    def doc(self) -> Doc:
+        return self.get_doc('full')
+
+    def span(self, start_char: int, end_char: int) -> Optional[Span]:
+        # The 'ner' and 'full' levels set the lemmas. Parsing the message just for a span costs more than cleaning
+        # the span text on its own, so return None if it was only tokenized
+        for level in analysis_levels[:0:-1]:
+            if level in self._docs:
+                return self._docs[level].char_span(start_char, end_char, alignment_mode='expand')
+
+        return None
+
+
 class EntityPropertyParser:
     """
-    Use spacy models to identifies named entities and attempt to link tokens to entities in wikidata
+    Use spacy models to identifies named entities and attempt to link tokens to entities in wikidata.
+
+    Each method only runs the components it needs: the PhraseMatchers only tokenize the message, and only the
+    'full' level runs the entity linkers. The linkers are added to the pipeline here, as changing the pipeline while
+    other threads run it is unsafe. `entity_linker_configs` has the config of each entity linker pipe that needs
+    one (e.g. the label files of 'local_entity_linker', an offline replacement of 'entityfishing').
+
+    The 'entityLinker' pipe uses a sqlite connection that only works in the thread that created it, so the linkers
+    are added and the 'full' parses run in a single dedicated thread, whichever thread calls the parser
     """
     def __init__(self,
                  entity_exact_label_filepath: str,
                  property_extended_label_filepath: str,
-                 model_type: str = 'trf'):
+                 model_type: str = 'trf',
+                 entity_linkers: Tuple[str, ...] = ('entityLinker', 'entityfishing'),
+                 entity_linker_configs: Optional[dict] = None):
         self.nlp = spacy.load(spacy_model_types[model_type])
-        # Add entity linker models
-        self.nlp.add_pipe('entityLinker')
-        self.nlp.add_pipe('entityfishing')
+        # Components run by the 'ner' level: the named entity recognizer and the ones the lemmatizer depends on
+        self._ner_pipes = [pipe for pipe in ('transformer', 'tok2vec', 'tagger', 'attribute_ruler', 'lemmatizer',
+                                             'ner') if pipe in self.nlp.pipe_names]
+
+        # Add entity linker models, in the thread that runs them
+        self._full_parse_executor = ThreadPoolExecutor(max_workers=1)
+        self._full_parse_executor.submit(self._add_entity_linkers, entity_linkers, entity_linker_configs or {}).result()
+
         self.ent_matcher = self._create_property_or_ent_phrase_matcher(entity_exact_label_filepath)
         self.prop_matcher = self._create_property_or_ent_phrase_matcher(property_extended_label_filepath)
 
     def __call__(self, doc: str):
-        return self.nlp(doc)
+        return self._parse(doc, 'full')
+
+    def _add_entity_linkers(self, entity_linkers: Tuple[str, ...], entity_linker_configs: dict) -> None:
+        for entity_linker in entity_linkers:
+            # add_pipe rejects a None config, so the pipes without one get an empty config
+            self.nlp.add_pipe(entity_linker, config=entity_linker_configs.get(entity_linker, {}))
+
+    def _parse(self, text: str, level: str) -> Doc:
+        if level == 'tokens':
+            return self.nlp.make_doc(text)
+
+        # The components are disabled per call instead of with nlp.select_pipes, which changes the pipeline for
+        # all the threads using it
+        if level == 'ner':
+            return self.nlp(text, disable=[pipe for pipe in self.nlp.pipe_names if pipe not in self._ner_pipes])
+
+        return self._full_parse_executor.submit(self.nlp, text).result()
+
+    def analyze(self, text: str) -> MessageAnalysis:
+        return MessageAnalysis(text, self._parse)
+
+    def _get_analysis(self, doc: Union[str, MessageAnalysis]) -> MessageAnalysis:
+        return doc if isinstance(doc, MessageAnalysis) else self.analyze(doc)
 
     def _create_property_or_ent_phrase_matcher(self, property_or_ent_label_filepath: str):
         labels_dict = json.load(open(property_or_ent_label_filepath, 'r'))
@@ -65,23 +148,27 @@ class EntityPropertyParser:
 
     def return_wikidata_entities_w_entity_linkers(
             self,
-            doc: str,
+            doc: Union[str, MessageAnalysis],
             entities_of_interest: Tuple[str, ...] = None,
-            entity_filter: callable = None
+            entity_filter: callable = None,
+            use_entity_linkers: bool = True
     ):
-
-        proc_doc = self.nlp(doc)
+        """
+        If `use_entity_linkers` is False, only the named entity recognizer and the exact match are used
+        """
+        proc_doc = self._get_analysis(doc).get_doc('full' if use_entity_linkers else 'ner')
 
         # Exact string match in the sentence
         wkdata_ents_v1 = [(self.nlp.vocab.strings[match_id], proc_doc[start: end].text)
                           for match_id, start, end in self.ent_matcher(proc_doc)]
 
         # Extract using the pretrained entity linkers
-        wkdata_ents_1 = _get_wikidata_entities_from_entity_linker(proc_doc)
-        wkdata_ents_2 = _get_wikidata_entities_from_entity_fishing(proc_doc)
-
+        wkdata_ents_v2_dict = {}
+        if use_entity_linkers:
+            wkdata_ents_1 = _get_wikidata_entities_from_entity_linker(proc_doc)
+            wkdata_ents_2 = _get_wikidata_entities_from_entity_fishing(proc_doc)
 
-        wkdata_ents_v2_dict = merge_dicts(wkdata_ents_1, wkdata_ents_2)
+            wkdata_ents_v2_dict = merge_dicts(wkdata_ents_1, wkdata_ents_2)
         spacy_ents = [ent for ent in proc_doc.ents]
 
         if entities_of_interest:
@@ -113,11 +200,13 @@ class EntityPropertyParser:
 
         return spacy_ents, wkdata_ents
 
-    def return_wikidata_properties(self, doc: str) -> list:
-        return [self.nlp.vocab.strings[match_id] for match_id, _, _ in self.prop_matcher(self.nlp(doc))]
+    def return_wikidata_properties(self, doc: Union[str, MessageAnalysis]) -> list:
+        return [self.nlp.vocab.strings[match_id]
+                for match_id, _, _ in self.prop_matcher(self._get_analysis(doc).get_doc('tokens'))]
 
-    def return_wikidata_entities_exact_match(self, doc: str) -> list:
-        return [self.nlp.vocab.strings[match_id] for match_id, _, _ in self.ent_matcher(self.nlp(doc))]
+    def return_wikidata_entities_exact_match(self, doc: Union[str, MessageAnalysis]) -> list:
+        return [self.nlp.vocab.strings[match_id]
+                for match_id, _, _ in self.ent_matcher(self._get_analysis(doc).get_doc('tokens'))]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import json
+from collections import defaultdict
+from typing import Dict, List, Tuple, Sequence
+
+from spacy.language import Language
+from spacy.tokens import Doc, Span
+
+from knowledge_graphs.EntityLabelIndex import normalize_label
+
+
+def _get_qid(wk_id: str) -> str:
+    # The KG label dicts are keyed by the entity URI, e.g. http://www.wikidata.org/entity/Q42
+    return wk_id.rsplit('/', 1)[-1]
+
+
+class LocalEntityLinker:
+    """
+    spaCy component that links the named entities of a doc to wikidata ids with a local alias -> QID table, as an
+    offline replacement of the entityfishing pipe.
+
+    Every label of an entity in the label files is an alias of it. Each label file has a weight, and the prior
+    probability of an entity given an alias is the sum of the weights of the files where the entity has the alias,
+    divided by the sum for all the entities with the alias. The aliases are normalized with `normalize_label`.
+    """
+    def __init__(self, alias_table: Dict[str, List[Tuple[str, float]]], min_score: float = 0.0):
+        self.alias_table = alias_table
+        self.min_score = min_score
+
+        # Same extension attributes set by the entityfishing pipe, so both can be read by the same code
+        for extension in ('kb_qid', 'nerd_score', 'url_wikidata'):
+            if not Span.has_extension(extension):
+                Span.set_extension(extension, default=None)
+
+    @classmethod
+    def from_label_files(cls, label_filepaths: Sequence[str], label_file_weights: Sequence[float],
+                         min_score: float = 0.0) -> 'LocalEntityLinker':
+        alias_weights = defaultdict(lambda: defaultdict(float))
+        for label_filepath, weight in zip(label_filepaths, label_file_weights):
+            for wk_id, labels in json.load(open(label_filepath, 'r')).items():
+                for label in ([labels] if isinstance(labels, str) else labels):
+                    alias = normalize_label(label)
+                    if alias:
+                        alias_weights[alias][_get_qid(wk_id)] += weight
+
+        # Candidates of each alias sorted by their prior probability
+        alias_table = {}
+        for alias, qid_weights in alias_weights.items():
+            total_weight = sum(qid_weights.values())
+            alias_table[alias] = sorted([(qid, qid_weight / total_weight) for qid, qid_weight in qid_weights.items()],
+                                        key=lambda candidate: candidate[1], reverse=True)
+
+        return cls(alias_table, min_score)
+
+    def link(self, text: str) -> Tuple[str, float]:
+        """
+        Return the most likely QID of a text and its prior probability, or (None, 0.0) if it is not an alias
+        """
+        candidates = self.alias_table.get(normalize_label(text))
+        return candidates[0] if candidates else (None, 0.0)
+
+    def __call__(self, doc: Doc) -> Doc:
+        for ent in doc.ents:
+            qid, score = self.link(ent.text)
+            if qid is not None and score >= self.min_score:
+                ent._.kb_qid = qid
+                ent._.nerd_score = score
+                ent._.url_wikidata = f'https://www.wikidata.org/wiki/{qid}'
+
+        return doc
+
+
+@Language.factory('local_entity_linker',
+                  default_config={'label_filepaths': [], 'label_file_weights': [], 'min_score': 0.0})
+def create_local_entity_linker(nlp: Language, name: str, label_filepaths: List[str],
+                               label_file_weights: List[float], min_score: float) -> LocalEntityLinker:
+    return LocalEntityLinker.from_label_files(
+        label_filepaths, label_file_weights or [1.0] * len(label_filepaths), min_score)
+
+
+if __name__ == '__main__':
+    linker = LocalEntityLinker({
+        normalize_label('The Matrix'): [('Q83495', 0.75), ('Q189600', 0.25)],
+        normalize_label('Keanu Reeves'): [('Q43416', 1.0)],
+    }, min_score=0.5)
+
+    assert linker.link('the matrix') == ('Q83495', 0.75)
+    assert linker.link('Reeves, Keanu') == ('Q43416', 1.0)
+    assert linker.link('Julia Roberts') == (None, 0.0)
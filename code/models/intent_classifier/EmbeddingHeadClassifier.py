@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+from typing import List, Optional
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+
+def _train_data_hash(train_data: dict, model_name: str, head: str) -> str:
+    return hashlib.sha1(json.dumps([train_data, model_name, head], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class EmbeddingHeadClassifier:
+    """
+    CPU classifier of texts based on a sentence-transformer and a linear head over its normalized embeddings.
+
+    The training examples are embedded once and the head is stored in `cache_filepath`, keyed by a hash of the
+    training data, so later startups only load the encoder. With the 'centroid' head the weights are the normalized
+    mean embeddings of each class (cosine similarity to the centroids). With the 'linear' head they are fitted
+    with a logistic regression. `quantize` applies dynamic int8 quantization to the linear layers of the encoder.
+    """
+    def __init__(self, train_data: dict,
+                 model_name: str = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
+                 head: str = 'centroid', cache_filepath: Optional[str] = None, quantize: bool = False):
+        self.encoder = SentenceTransformer(model_name, device='cpu')
+        if quantize:
+            self.encoder = torch.quantization.quantize_dynamic(self.encoder, {torch.nn.Linear}, dtype=torch.qint8)
+
+        train_data_hash = _train_data_hash(train_data, model_name, head)
+        if cache_filepath and os.path.exists(cache_filepath):
+            with np.load(cache_filepath, allow_pickle=False) as head_arrays:
+                if str(head_arrays['train_data_hash']) == train_data_hash:
+                    self.classes = head_arrays['classes'].tolist()
+                    self.weights = head_arrays['weights']
+                    self.bias = head_arrays['bias']
+                    return
+
+        self.classes = sorted(train_data.keys())
+        self.weights, self.bias = self._fit_head(train_data, head)
+        if cache_filepath:
+            np.savez(cache_filepath, train_data_hash=np.array(train_data_hash), classes=np.array(self.classes),
+                     weights=self.weights, bias=self.bias)
+
+    def _fit_head(self, train_data: dict, head: str):
+        examples = [example for class_ in self.classes for example in train_data[class_]]
+        labels = np.array([i for i, class_ in enumerate(self.classes) for _ in train_data[class_]])
+        embeddings = self.encode(examples)
+
+        if head == 'centroid':
+            centroids = np.stack([embeddings[labels == i].mean(axis=0) for i in range(len(self.classes))])
+            weights = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+            return weights.astype(np.float32), np.zeros(len(self.classes), dtype=np.float32)
+
+        elif head == 'linear':
+            from sklearn.linear_model import LogisticRegression
+            regression = LogisticRegression(max_iter=1000).fit(embeddings, labels)
+            return regression.coef_.astype(np.float32), regression.intercept_.astype(np.float32)
+
+        raise ValueError(f'Unknown head {head}, expected one of: centroid, linear')
+
+    def encode(self, docs: List[str], batch_size: int = 32) -> np.ndarray:
+        with torch.inference_mode():
+            return self.encoder.encode(docs, batch_size=batch_size, convert_to_numpy=True,
+                                       normalize_embeddings=True, show_progress_bar=False)
+
+    def classify_batch(self, docs: List[str], batch_size: int = 32) -> List[str]:
+        scores = self.encode(docs, batch_size) @ self.weights.T + self.bias
+        return [self.classes[i] for i in scores.argmax(axis=1)]
@@ -1,22 +1,28 @@
 import os
 import json
+from typing import List, Optional
 
 import numpy as np
 import spacy
 import classy_classification
 
-from utils.silencer import silent
+from utils.response_cache import ResponseCache
+from models.intent_classifier.EmbeddingHeadClassifier import EmbeddingHeadClassifier
+from models.intent_classifier.RuleBasedIntentRouter import RuleBasedIntentRouter
 
 
-def create_few_shot_classifier(train_data: dict):
+def create_few_shot_classifier(train_data: dict, device: str = 'gpu'):
     nlp = spacy.blank("en")
     nlp.add_pipe(
         "text_categorizer",
         config={
             "data": train_data,
             "model": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            "device": "gpu",
-            "cat_type": "multi-label"
+            "device": device,
+            "cat_type": "multi-label",
+            # No training logs nor encoding progress bars. The output is silenced here instead of redirecting the
+            #  stdout of the process, which would also hide the output of the other threads
+            "verbose": False
         }
     )
 
@@ -24,22 +30,67 @@ def create_few_shot_classifier(train_data: dict):
 
 
 class InteractionTypeClassifier:
-    @silent
-    def __init__(self, train_examples_path: str):
+    """
+    Classifies the type of interaction requested in a message. In the 'few_shot' mode, a classy_classification
+    few-shot model is fitted at startup. In the 'embedding_head' mode, an EmbeddingHeadClassifier runs on the CPU
+    with a head fitted once and stored in `head_cache_filepath`. If `use_rule_router` is set, the messages with
+    strong intent cues are classified by a RuleBasedIntentRouter and skip the model. The intents of the messages
+    classified by the model are cached in `intent_cache` if given
+    """
+    def __init__(self, train_examples_path: str, mode: str = 'few_shot', device: str = 'gpu',
+                 head: str = 'centroid', head_cache_filepath: Optional[str] = None, quantize: bool = False,
+                 use_rule_router: bool = False, intent_cache: Optional[ResponseCache] = None):
         with open(train_examples_path, 'r') as fp:
             train_data = json.load(fp)
 
-        self.classifier = create_few_shot_classifier(train_data=train_data)
-        self.classes = list(self.classifier(" ")._.cats.keys())
+        self.mode = mode
+        self.rule_router = RuleBasedIntentRouter() if use_rule_router else None
+        self.intent_cache = intent_cache
+        if mode == 'few_shot':
+            self.classifier = create_few_shot_classifier(train_data=train_data, device=device)
+            self.classes = list(self.classifier(" ")._.cats.keys())
+
+        elif mode == 'embedding_head':
+            self.classifier = EmbeddingHeadClassifier(
+                train_data, head=head, cache_filepath=head_cache_filepath, quantize=quantize)
+            self.classes = self.classifier.classes
+
+        else:
+            raise ValueError(f'Unknown mode {mode}, expected one of: few_shot, embedding_head')
 
-    @silent
     def __call__(self, doc: str):
-        return self.classes[np.array(list(self.classifier(doc)._.cats.values())).argmax()]
+        return self.classify_batch([doc])[0]
+
+    def classify_batch(self, docs: List[str], batch_size: int = 32) -> List[str]:
+        """
+        Classify several messages, encoding up to `batch_size` of them in a single forward pass of the model
+        """
+        intents = [self.rule_router.route(doc) for doc in docs] if self.rule_router else [None] * len(docs)
+        if self.intent_cache:
+            intents = [intent or self.intent_cache.get(doc) for intent, doc in zip(intents, docs)]
+
+        # Only the messages not routed by the rules go through the model
+        model_doc_ids = [i for i, intent in enumerate(intents) if intent is None]
+        if len(model_doc_ids) > 0:
+            model_docs = [docs[i] for i in model_doc_ids]
+            if self.mode == 'embedding_head':
+                model_intents = self.classifier.classify_batch(model_docs, batch_size)
+            else:
+                model_intents = [self.classes[np.array(list(proc_doc._.cats.values())).argmax()]
+                                 for proc_doc in self.classifier.pipe(model_docs, batch_size=batch_size)]
+
+            for i, intent in zip(model_doc_ids, model_intents):
+                intents[i] = intent
+                if self.intent_cache:
+                    self.intent_cache.put(docs[i], intent)
+
+        return intents
 
 
 if __name__ == '__main__':
     input_cls = InteractionTypeClassifier(
-        os.path.join('../../..', 'setup_data', 'first_filter_train_examples.json')
+        os.path.join('../../..', 'setup_data', 'first_filter_train_examples.json'),
+        mode='embedding_head', head_cache_filepath='first_filter_head.npz'
     )
 
     # Verify behaviour on relatively difficult examples
@@ -56,4 +107,17 @@ if __name__ == '__main__':
         "Hey, i am interested in a movie that is as good as The Goonies and Toy Story")
     assert should_be_recommendation == 'Recommendation Questions'
 
+    # The batched classification returns the same intents
+    assert input_cls.classify_batch(["Hey man, what's up", "hey would you be so kind to display a picture of Ali G"]) \
+        == ['Conversation', 'Media Question']
+
+    # Accuracy of both modes on messages that are not training examples, to compare them before changing the mode
+    from models.intent_classifier.RuleBasedIntentRouter import held_out_examples
+    few_shot_cls = InteractionTypeClassifier(
+        os.path.join('../../..', 'setup_data', 'first_filter_train_examples.json'), mode='few_shot')
+    for mode, cls in (('few_shot', few_shot_cls), ('embedding_head', input_cls)):
+        intents = cls.classify_batch([message for message, _ in held_out_examples])
+        num_correct = sum(intent == expected_intent for intent, (_, expected_intent) in zip(intents, held_out_examples))
+        print(f'{mode} accuracy on the held out examples: {num_correct}/{len(held_out_examples)}')
+
 
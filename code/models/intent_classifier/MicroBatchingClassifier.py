@@ -0,0 +1,68 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from models.intent_classifier.InteractionTypeClassifier import InteractionTypeClassifier
+
+
+class MicroBatchingClassifier:
+    """
+    Classifies the messages sent concurrently by several threads together, with `classify_batch` in a background
+    thread. A batch is classified when it has `max_batch_size` messages, or `max_wait` seconds after its first
+    message arrived, so a message on its own waits at most `max_wait` seconds more than with a direct call.
+    """
+    def __init__(self, classifier: InteractionTypeClassifier, max_batch_size: int = 32, max_wait: float = 0.01):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        # Process where the background thread was started. Threads do not survive a fork, so a forked worker
+        # starts its own
+        self._worker_pid = None
+        self._num_batches = 0
+        self._num_messages = 0
+
+    def __call__(self, doc: str) -> str:
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                self._requests = queue.Queue()
+                threading.Thread(target=self._classify_batches, args=(self._requests,), daemon=True).start()
+                self._worker_pid = os.getpid()
+
+        future = Future()
+        self._requests.put((doc, future))
+        return future.result()
+
+    def _classify_batches(self, requests: queue.Queue):
+        while True:
+            batch = [requests.get()]
+
+            # Wait for more messages until the batch is full or the first message waited too long
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(requests.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                intents = self.classifier.classify_batch([doc for doc, _ in batch], batch_size=self.max_batch_size)
+                for (_, future), intent in zip(batch, intents):
+                    future.set_result(intent)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+            self._num_batches += 1
+            self._num_messages += len(batch)
+
+    def stats(self) -> dict:
+        """
+        Number of batches classified and their mean size
+        """
+        return {'batches': self._num_batches,
+                'mean_batch_size': self._num_messages / self._num_batches if self._num_batches else 0}
@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import threading
+from collections import Counter
+from typing import Optional, Tuple
+
+# High precision rules, tried in order. A message matching none of them is left to the intent classifier. The rules
+#  with `skip_titles` do not match keywords inside a title or name, e.g. the "picture" of "The Picture of Dorian Gray"
+intent_rules = (
+    # Fact questions first, as their titles and entities can contain the keywords of the other intents
+    (r'\b(who|which (actor|actress|person|company|studio)) (directed|produced|edited|wrote|composed|designed|plays'
+     r'|played|starred)\b', 'Factual Question/Embedding/Crowdsourcing', False),
+    (r'\b(who|what|when|where) (is|was|are|were) the (director|producer|screenwriter|writer|editor|composer|genre|'
+     r'(original )?language|(production|costume) designer|production company|country of origin|publication date|'
+     r'release date|main topic|box office)\b', 'Factual Question/Embedding/Crowdsourcing', False),
+    (r'\b(what|which) genre\b', 'Factual Question/Embedding/Crowdsourcing', False),
+    # Greetings and small talk made only of a greeting
+    (r"^\W*(hi|hello|hey|hallo|hoi|gruezi|good (morning|afternoon|evening)|what'?s up|how are you( doing)?"
+     r"|how is it going|how have you been)\W*$", 'Conversation', False),
+    (r'\b(recommend(ation)?s?|suggest(ion)?s?)\b', 'Recommendation Questions', True),
+    (r'\b(movies|films) (similar to|like)\b', 'Recommendation Questions', True),
+    (r'\b(pictures?|picures?|images?|photos?|portraits?|pics?)\b', 'Media Question', True),
+    (r'\b((what|how) (does|do|did) .+ look|what .+ (looks|looked)) like\b', 'Media Question', True),
+)
+
+# Quoted text, and runs of two or more capitalized words (possibly joined by lowercase function words), taken as
+#  titles or names. Matched case sensitively
+title_regex = re.compile(r'"[^"]*"|\u201c[^\u201d]*\u201d|'
+                         r"(?<!\w)'[^']+'(?!\w)|"
+                         r"\b[A-Z][\w'\u2019:.-]*(\s+((of|the|a|an|and|in|on|to|for|with|at|from)\s+)*"
+                         r"[A-Z][\w'\u2019:.-]*)+")
+
+# Messages not in the training examples, with their intent, to measure the precision of the rules
+held_out_examples = (
+    ('Who directed The Picture of Dorian Gray?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('What is the genre of Star Trek: The Motion Picture?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('Which movie looks like Inception?', 'Recommendation Questions'),
+    ('Can you suggest who wrote Inception?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('Who wrote the screenplay of Picture Perfect?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('When was "Moving Pictures" released?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('What genre is Mystic Pizza?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('Who is the composer of Interstellar?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('Which company produced Toy Story?', 'Factual Question/Embedding/Crowdsourcing'),
+    ('who played neo in the matrix', 'Factual Question/Embedding/Crowdsourcing'),
+    ('Tell me about the movie The Recommendation Letter', 'Factual Question/Embedding/Crowdsourcing'),
+    ('Show me a picture of Meryl Streep', 'Media Question'),
+    ('What does Keanu Reeves look like?', 'Media Question'),
+    ('can i see a photo of tom hanks', 'Media Question'),
+    ('Do you have an image of Audrey Hepburn?', 'Media Question'),
+    ('I wonder what Cate Blanchett looked like in Elizabeth', 'Media Question'),
+    ('Show me a picture of the cast of Picture Perfect', 'Media Question'),
+    ('Can you recommend movies like Alien and Predator?', 'Recommendation Questions'),
+    ('Any suggestions for films similar to Amelie?', 'Recommendation Questions'),
+    ('I liked Heat, what would you recommend?', 'Recommendation Questions'),
+    ('Give me movies like the notebook', 'Recommendation Questions'),
+    ('Which films are similar to The Shining and It?', 'Recommendation Questions'),
+    ('Hi there!', 'Conversation'),
+    ('Good evening', 'Conversation'),
+    ('how are you doing?', 'Conversation'),
+    ('What do you think about the weather?', 'Conversation'),
+    ('I just watched a movie that looks like a painting', 'Conversation'),
+)
+
+
+def _mask_titles(doc: str) -> str:
+    return title_regex.sub('TITLE', doc)
+
+
+class RuleBasedIntentRouter:
+    """
+    Classifies the messages with strong intent cues (greetings, keywords of media and recommendation requests,
+    common fact questions) with regex rules, so they skip the intent classifier. It counts the messages routed by
+    the rules and by the classifier.
+    """
+    def __init__(self, rules: Tuple[Tuple[str, str, bool], ...] = intent_rules):
+        self.rules = [(re.compile(pattern, re.IGNORECASE), intent, skip_titles)
+                      for pattern, intent, skip_titles in rules]
+        self._lock = threading.Lock()
+        self._num_messages = 0
+        self._short_circuited = Counter()
+
+    def route(self, doc: str) -> Optional[str]:
+        """
+        Return the intent of the first rule matching the message, or None if it has to go to the classifier
+        """
+        masked_doc = _mask_titles(doc)
+        intent = next((intent for pattern, intent, skip_titles in self.rules
+                       if pattern.search(masked_doc if skip_titles else doc)), None)
+
+        with self._lock:
+            self._num_messages += 1
+            if intent is not None:
+                self._short_circuited[intent] += 1
+
+        return intent
+
+    def stats(self) -> dict:
+        """
+        Number of messages routed, and fraction and number per intent of the ones short-circuited by the rules
+        """
+        num_short_circuited = sum(self._short_circuited.values())
+        return {'messages': self._num_messages, 'short_circuited': num_short_circuited,
+                'short_circuited_fraction': num_short_circuited / self._num_messages if self._num_messages else 0,
+                'short_circuited_per_intent': dict(self._short_circuited)}
+
+
+def evaluate_precision(router: RuleBasedIntentRouter, examples) -> Tuple[int, int, list]:
+    """
+    Number of (message, intent) examples routed by the rules, how many of them to the right intent, and the wrong ones
+    """
+    routed = [(message, intent, router.route(message)) for message, intent in examples]
+    routed = [(message, intent, routed_intent) for message, intent, routed_intent in routed
+              if routed_intent is not None]
+    wrong = [(message, intent, routed_intent) for message, intent, routed_intent in routed if intent != routed_intent]
+    return len(routed) - len(wrong), len(routed), wrong
+
+
+if __name__ == '__main__':
+    router = RuleBasedIntentRouter()
+
+    # Precision of the rules on the training examples of the intent classifier, and on held out examples
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'first_filter_train_examples.json')) as fp:
+        train_data = json.load(fp)
+
+    for name, examples in (('training', [(example, intent) for intent, examples_ in train_data.items()
+                                         for example in examples_]),
+                           ('held out', held_out_examples)):
+        num_correct, num_routed, wrong = evaluate_precision(router, examples)
+        print(f'Rule precision on the {name} examples: {num_correct}/{num_routed} '
+              f'({num_routed}/{len(examples)} short-circuited)')
+        for message, intent, routed_intent in wrong:
+            print(f'\t {message}: {intent} routed as {routed_intent}')
+
+        assert num_correct == num_routed
+
+    print(router.stats())
@@ -1,27 +1,42 @@
 import re
-from typing import Tuple, Optional
+from functools import lru_cache
+from typing import Tuple, Optional, Union
 
 import spacy
+from spacy.tokens import Span
 
 
-nlp = spacy.load('en_core_web_sm')
+@lru_cache(maxsize=1)
+def get_nlp():
+    # Loaded on first use instead of at import time
+    return spacy.load('en_core_web_sm')
 
 
-def basic_tokenizing_and_cleaning(text: str) -> str:
+def basic_tokenizing_and_cleaning(text: Union[str, Span]) -> str:
     """
-    Lemmatize, remove punctutation, and stopwords of a string
+    Lemmatize, remove punctutation, and stopwords of a string, or of a span of an already parsed message
     :return:
     """
-    return ' '.join([token.lemma_ for token in nlp(text) if not token.is_punct and not token.is_stop])
+    tokens = text if isinstance(text, Span) else get_nlp()(text)
+    return ' '.join([token.lemma_ for token in tokens if not token.is_punct and not token.is_stop])
 
 
 class BasicRegexMatcher:
     def __init__(self, regex_patterns: Tuple[Tuple[str, int], ...]):
         self.regex_patterns = regex_patterns
 
-    def match_string(self, document: str) -> Optional[str]:
+    def match_string(self, document: str, analysis=None) -> Optional[str]:
+        """
+        `analysis` is an optional MessageAnalysis of the document. If given, the matched text is cleaned using its
+        parsed tokens instead of parsing it again
+        """
         for pattern, group_to_extract in self.regex_patterns:
             if match := re.search(pattern, document, re.IGNORECASE):
+                if analysis is not None and analysis.text == document:
+                    span = analysis.span(match.start(group_to_extract), match.end(group_to_extract))
+                    if span is not None:
+                        return basic_tokenizing_and_cleaning(span)
+
                 return basic_tokenizing_and_cleaning(match.group(group_to_extract))
 
         return None
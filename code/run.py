@@ -13,7 +13,7 @@ crowd_sourcing_params = conversation_params['crowd_sourcing']
 first_funnel_config = conversation_params['first_funnel_info']
 
 url = config_args['chatroom_server']['url']  # url of the speakeasy server
-listen_freq = conversation_params['listen_freq']
+concurrency_params = conversation_params['concurrency']
 
 
 if __name__ == '__main__':
@@ -24,15 +24,10 @@ if __name__ == '__main__':
     password = getpass.getpass('Connect the instance to the Speakeasy server: [press enter]')
     bot.connect()
 
-    reconnection_listening_attempts = 0
-
-    try:
-        bot.listen()
-    except Exception as e:
-        print(e)
-        reconnection_listening_attempts += 1
-        if reconnection_listening_attempts > 5:
-            raise e
-        bot.connect()
-        bot.listen()
+    # Handle the rooms one after the other ('sync'), concurrently ('async'), or in worker processes ('processes')
+    listen = {'sync': bot.listen, 'async': bot.listen_async, 'processes': bot.listen_processes}[
+        concurrency_params['mode']]
+
+    # Failed requests to the server are retried (logging in again if needed) by the bot's client
+    listen()
 
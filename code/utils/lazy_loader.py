@@ -0,0 +1,76 @@
+import time
+import threading
+from typing import Callable
+
+
+class LazyLoader:
+    """
+    Proxy of an object created by `load_fn`, loaded in a background thread once `start` is called, or on first use
+    otherwise. Accessing an attribute of the object (or calling it) waits until it is loaded, so the proxy can be
+    used in place of the object.
+    """
+    def __init__(self, load_fn: Callable[[], object], name: str):
+        self._load_fn = load_fn
+        self._name = name
+        self._obj = None
+        self._exception = None
+        self._started = False
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self.load_time = None
+
+    def start(self) -> 'LazyLoader':
+        if self._start_loading():
+            threading.Thread(target=self._load, daemon=True).start()
+
+        return self
+
+    def _start_loading(self) -> bool:
+        # Only the first caller loads the object
+        with self._lock:
+            if self._started:
+                return False
+
+            self._started = True
+            return True
+
+    def _load(self):
+        start = time.time()
+        try:
+            self._obj = self._load_fn()
+        except Exception as e:
+            self._exception = e
+
+        self.load_time = time.time() - start
+        print(f'- Loaded {self._name} in {self.load_time:.1f} s')
+        self._loaded.set()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    @property
+    def loaded_ok(self) -> bool:
+        # Loaded without raising an exception, so using the object neither waits nor raises
+        return self._loaded.is_set() and self._exception is None
+
+    def get(self):
+        if not self._loaded.is_set():
+            if self._start_loading():
+                self._load()
+            self._loaded.wait()
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._obj
+
+    def __getattr__(self, attr: str):
+        # Only called for the attributes not found in the proxy
+        if attr.startswith('__') or attr in ('_load_fn', '_name', '_obj', '_exception', '_started', '_lock', '_loaded'):
+            raise AttributeError(attr)
+
+        return getattr(self.get(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
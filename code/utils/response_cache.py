@@ -0,0 +1,93 @@
+import re
+import time
+import random
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def normalize_message(text: str) -> str:
+    # Lowercase, and drop punctuation and repeated spaces, so "Hi!" and "hi" share an entry
+    return ' '.join(re.sub(r'[\W_]+', ' ', text.lower()).split())
+
+
+class ResponseCache:
+    """
+    LRU cache with a time to live of the responses to messages, keyed on the normalized message.
+
+    Each entry keeps a pool of up to `pool_size` responses. Until the pool is full, a lookup is a miss, so a new
+    response is computed and added to it. Afterwards, lookups return a random response of the pool, which keeps
+    some variety in sampled responses. Use `pool_size=1` for deterministic outputs (e.g. intents). Entries older
+    than `ttl` seconds are computed again, and the least recently used ones are evicted above `max_size` entries.
+    """
+    def __init__(self, max_size: int = 1000, ttl: float = 3600, pool_size: int = 1):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.pool_size = pool_size
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, message: str):
+        key = normalize_message(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            if entry is None or len(entry[1]) < self.pool_size:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return random.choice(entry[1])
+
+    def put(self, message: str, response) -> None:
+        key = normalize_message(message)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (time.time(), [])
+
+            responses = self._entries[key][1]
+            if len(responses) < self.pool_size:
+                responses.append(response)
+
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, message: str, compute_fn: Callable[[str], object]):
+        response = self.get(message)
+        if response is None:
+            # Computed out of the lock, so concurrent misses do not wait for each other
+            response = compute_fn(message)
+            self.put(message, response)
+
+        return response
+
+    def stats(self) -> dict:
+        """
+        Number of hits, misses and entries, and hit rate of the cache
+        """
+        lookups = self._hits + self._misses
+        return {'hits': self._hits, 'misses': self._misses, 'hit_rate': self._hits / lookups if lookups else 0,
+                'entries': len(self._entries)}
+
+
+if __name__ == '__main__':
+    cache = ResponseCache(max_size=2, ttl=60, pool_size=2)
+
+    # The pool of a message is filled before it is served from the cache
+    assert cache.get_or_compute('Hi!', lambda message: 'Hello') == 'Hello'
+    assert cache.get_or_compute('hi', lambda message: 'Hey') == 'Hey'
+    assert cache.get_or_compute('  HI ', lambda message: 'Not computed') in ('Hello', 'Hey')
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+    # The least recently used message is evicted
+    cache.put('how are you', 'Good')
+    cache.put('what is up', 'Nothing')
+    assert cache.get('hi') is None
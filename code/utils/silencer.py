@@ -1,15 +0,0 @@
-from contextlib import redirect_stdout
-from io import StringIO
-
-
-class NullIO(StringIO):
-    def write(self, txt):
-        pass
-
-
-def silent(fn):
-    """Decorator to silence functions."""
-    def silent_fn(*args, **kwargs):
-        with redirect_stdout(NullIO()):
-            return fn(*args, **kwargs)
-    return silent_fn
@@ -1,3 +1,6 @@
+import os
+import resource
+
 import yaml
 
 
@@ -17,3 +20,12 @@ def merge_dicts(dict1: dict, dict2: dict) -> dict:
     keys = dict1.keys() | dict2.keys()
 
     return {k: {**dict1.get(k, {}), **dict2.get(k, {})} for k in keys}
+
+
+def get_rss_mb() -> float:
+    # Current resident memory of the process (Linux), or the peak one if /proc is not available
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm', 'r') as ifile:
+            return int(ifile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10